@@ -0,0 +1,288 @@
+"""
+Offline benchmark of the bot's commands against a fake Riot Games API and a synthetic database.
+
+Run from the main folder with:
+
+    python3 benchmarks/benchmark.py --users 5000 --servers 50 --runs 30
+
+Save the results with --save and check a later run against them with --compare to catch regressions
+in the hot paths before deploying.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+# Make the bot's modules importable when running from the main folder or from benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeriot
+import config
+
+championIds = [1, 103, 62]
+
+def configure(directory):
+    """
+    Point the bot's settings at a temporary database and champion index before any bot module that reads
+    them is imported. The benchmark never talks to Riot Games or Discord, so made up keys are used when
+    there is no constants.py.
+
+    Arguments:
+    directory - the temporary folder for the database and champion index
+    """
+    config.DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(directory, 'benchmark.db')}"
+    config.DATA_DRAGON_DIRECTORY = directory
+    config.CHAMPION_DIRECTORY = os.path.join(directory, "champion")
+    config.CHAMPION_INDEX_PATH = os.path.join(directory, "championIndex.json")
+    config.RIOT_APP_RATE_LIMITS = "100000:1"
+    with open(config.CHAMPION_INDEX_PATH, "w", encoding = "utf8") as f:
+        json.dump({"version": "14.1.1", "champions": {str(championId): {"name": f"Champion {championId}",
+                                                                         "icon": f"Champion{championId}.png"}
+                                                      for championId in championIds}}, f)
+    try:
+        import constants
+    except ImportError:
+        sys.modules["constants"] = types.SimpleNamespace(RIOT_KEY = "benchmark", DISCORD_TOKEN = "benchmark")
+
+async def populate(accountCount, userCount, serverCount, server):
+    """
+    Fill the database with made up accounts registered across several servers, each with some rank history
+
+    Arguments:
+    accountCount - the number of Riot Games accounts to create
+    userCount - the number of server registrations to create
+    serverCount - the number of servers the registrations are spread across
+    server - the fake Riot Games API, told about every summoner so they show up in its leagues
+
+    Returns:
+    registrations - the list of (discordId, serverId) pairs created
+    """
+    import database
+    import users
+    await database.init()
+    now = time.time()
+    accounts, history, registrations = [], [], set()
+    async with database.Session() as session:
+        for i in range(accountCount):
+            puuID = f"puuid-player{i}-bench"
+            tier, division, lp, _, _ = fakeriot.rankFor(f"summoner-{puuID}-start")
+            account = users.RiotAccount(puuID, f"Player{i}", "BENCH", f"summoner-{puuID}", f"account-{puuID}", 1,
+                                        tier, division, lp)
+            account.lastUpdated = now - random.uniform(0, 3600)
+            accounts.append(account)
+
+            # Spread a few rank history points over the last 30 days
+            for day in (28, 21, 14, 7, 0):
+                entry = users.RankHistory(account)
+                entry.timestamp = now - day * 86400 - random.uniform(0, 3600)
+                entry.value += random.randint(-100, 100)
+                history.append(entry)
+        server.addSummoners([account.summonerID for account in accounts])
+
+        # Register every account in at least one server, then add extra registrations at random
+        while len(registrations) < userCount:
+            i = len(registrations) if len(registrations) < accountCount else random.randrange(accountCount)
+            registrations.add((i, random.randrange(serverCount) + 1))
+        members = []
+        for discordId, serverId in registrations:
+            account = accounts[discordId]
+            members.append(users.User(discordId, serverId, account, account.currRank, account.currDivision,
+                                      max(account.currLP - 20, 0)))
+        session.add_all(accounts + history + members)
+        await session.commit()
+    return sorted(registrations)
+
+def percentile(samples, fraction):
+    """
+    Get a percentile of a list of samples using the nearest rank
+    """
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+async def measure(name, command, runs, server, results):
+    """
+    Run a command several times and record its latency, Riot Games API calls and memory use
+
+    Arguments:
+    name - the name the results are stored under
+    command - coroutine function called with the run number
+    runs - the number of times to run the command
+    server - the fake Riot Games API, used to count the requests the command made
+    results - the dictionary the results are added to
+    """
+    latencies, errors = [], 0
+    calls = server.getCallCount()
+    for run in range(runs):
+        start = time.perf_counter()
+        try:
+            await command(run)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    calls = server.getCallCount() - calls
+
+    # Measure memory in one extra run since tracing allocations slows every other run down
+    tracemalloc.start()
+    try:
+        await command(runs)
+    except Exception:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results[name] = {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                     "apiCalls": calls / runs, "peakMemory": peak, "errors": errors}
+    print(f"{name:<22} p50 {results[name]['p50'] * 1000:8.1f}ms  p95 {results[name]['p95'] * 1000:8.1f}ms  "
+          f"api calls {results[name]['apiCalls']:7.1f}  peak memory {peak / 1024:8.0f}KiB  errors {errors}")
+
+async def benchmark(arguments):
+    """
+    Start the fake Riot Games API, build the synthetic database and measure every command
+
+    Returns:
+    results - dictionary of command name to its latency, API call and memory results
+    """
+    server = fakeriot.FakeRiotServer(arguments.latency, arguments.jitter, arguments.rate429, arguments.errorRate,
+                                     arguments.retryAfter, championIds, arguments.divisionSize)
+    url = await server.start()
+
+    import riot
+    import charts
+    import commands
+    import database
+    import leaderboards
+    import roster
+    riot.platforms["na1"] = url
+    riot.regions["americas"] = url
+
+    start = time.perf_counter()
+    registrations = await populate(arguments.accounts or max(arguments.users * 2 // 3, 1), arguments.users,
+                                   arguments.servers, server)
+    print(f"Built database with {len(registrations)} registrations in {arguments.servers} servers "
+          f"({time.perf_counter() - start:.1f}s)\n")
+
+    # Start the chart rendering processes first, as the bot does when it starts
+    await charts.warmUp()
+
+    # Benchmark the largest server, where the leaderboards are the slowest
+    sizes = {}
+    for _, serverId in registrations:
+        sizes[serverId] = sizes.get(serverId, 0) + 1
+    largest = max(sizes, key = sizes.get)
+    members = [discordId for discordId, serverId in registrations if serverId == largest]
+    perPage = 5
+    importSize = 100
+
+    async def register(run):
+        await commands.register(10 ** 9 + run, largest, f"NewPlayer{run}", "BENCH", "GOLD", "II", 50)
+
+    async def importPlayers(run):
+        # Import a server of new players into a server of its own, as when moving a community to the bot
+        records = [{"discordId": 2 * 10 ** 9 + i, "username": f"Imported{run}x{i}", "tag": "BENCH", "rank": "GOLD",
+                    "division": "II", "lp": 50} for i in range(importSize)]
+        imported, failed = await roster.importPlayers(10 ** 6 + run, records)
+        if imported != importSize:
+            raise Exception(f"{len(failed)} players were not imported")
+
+    async def leaderboard(run):
+        await commands.getLeaderboardSize(largest)
+        await commands.getLastUpdated(largest)
+        await commands.getLeaderboardEmbed(largest, leaderboards.IMPROVEMENT, 1, perPage)
+
+    async def leaderboardRefresh(run):
+        await commands.updateRanks(largest, maxAge = 0)
+        await leaderboard(run)
+
+    async def ranks(run):
+        await commands.getLeaderboardSize(largest)
+        await commands.getLastUpdated(largest)
+        await commands.getLeaderboardEmbed(largest, leaderboards.RANK, 1, perPage)
+
+    async def info(run):
+        await commands.displayInfo(f"<@{random.choice(members)}>", largest)
+
+    results = {}
+    print(f"Server {largest} with {sizes[largest]} players, {arguments.runs} runs per command\n")
+    await measure("/register", register, arguments.runs, server, results)
+    await measure(f"/import {importSize}", importPlayers, arguments.runs, server, results)
+    await measure("/leaderboard", leaderboard, arguments.runs, server, results)
+    await measure("/leaderboard refresh", leaderboardRefresh, arguments.runs, server, results)
+    await measure("/ranks", ranks, arguments.runs, server, results)
+    await measure("/info", info, arguments.runs, server, results)
+    print(f"\nRequests by endpoint: {json.dumps(server.calls, indent = 1)}")
+    print(f"Maximum resident memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MiB")
+
+    await riot.client.close()
+    await database.close()
+    await server.stop()
+    charts.executor.shutdown()
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the results to a saved baseline
+
+    Arguments:
+    results - the results of this run
+    baseline - the results of an earlier run
+    tolerance - the fraction a p95 latency can grow by before it counts as a regression
+
+    Returns:
+    regressions - the list of regression descriptions, empty if there were none
+    """
+    regressions = []
+    for name, previous in baseline.items():
+        if name not in results:
+            continue
+        current = results[name]
+        if current["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {previous['p95'] * 1000:.1f}ms -> {current['p95'] * 1000:.1f}ms")
+        if current["apiCalls"] > previous["apiCalls"]:
+            regressions.append(f"{name} api calls {previous['apiCalls']:.1f} -> {current['apiCalls']:.1f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the bot's commands against a fake Riot Games API")
+    parser.add_argument("--users", type = int, default = 5000, help = "number of server registrations")
+    parser.add_argument("--accounts", type = int, default = None, help = "number of Riot Games accounts (default 2/3 of users)")
+    parser.add_argument("--servers", type = int, default = 50, help = "number of servers")
+    parser.add_argument("--runs", type = int, default = 30, help = "number of times each command is run")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "average seconds per Riot Games API request")
+    parser.add_argument("--jitter", type = float, default = 0.01, help = "standard deviation of the request time")
+    parser.add_argument("--rate429", type = float, default = 0.0, help = "fraction of requests answered with 429")
+    parser.add_argument("--error-rate", dest = "errorRate", type = float, default = 0.0,
+                        help = "fraction of requests answered with 500")
+    parser.add_argument("--retry-after", dest = "retryAfter", type = int, default = 1, help = "Retry-After sent with 429s")
+    parser.add_argument("--division-size", dest = "divisionSize", type = int, default = fakeriot.divisionSize,
+                        help = "players in each fake tier/division, most of them unregistered")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic data")
+    parser.add_argument("--save", help = "save the results to this JSON file")
+    parser.add_argument("--compare", help = "compare the results to a JSON file saved with --save")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "allowed p95 growth when comparing")
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        results = asyncio.run(benchmark(arguments))
+
+    if arguments.save:
+        with open(arguments.save, "w", encoding = "utf8") as f:
+            json.dump(results, f, indent = 1)
+    if arguments.compare:
+        with open(arguments.compare, encoding = "utf8") as f:
+            regressions = compare(results, json.load(f), arguments.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
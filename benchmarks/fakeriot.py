@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import random
+from aiohttp import web
+
+tiers = ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND"]
+divisions = ["IV", "III", "II", "I"]
+apexTiers = ["MASTER", "GRANDMASTER", "CHALLENGER"]
+pageSize = 205
+
+# Number of players in each league of a large platform, most of them never registered with the bot
+divisionSize = 50000
+apexSizes = {"MASTER": 5000, "GRANDMASTER": 700, "CHALLENGER": 300}
+
+def rankFor(summonerId):
+    """
+    Get the made up but repeatable rank of a summoner
+
+    Arguments:
+    summonerId - the summoner ID
+
+    Returns:
+    tier, division, lp, wins, losses - the summoner's ranked information
+    """
+    value = int(hashlib.md5(summonerId.encode()).hexdigest(), 16)
+    points = value % 3300
+    wins, losses = 20 + value % 200, 20 + (value // 200) % 200
+    if points >= 2800:
+        return apexTiers[min((points - 2800) // 200, 2)], "I", points - 2800, wins, losses
+    return tiers[points // 400], divisions[(points % 400) // 100], points % 100, wins, losses
+
+class FakeRiotServer:
+    def __init__(self, latency = 0.05, jitter = 0.01, rate429 = 0.0, errorRate = 0.0, retryAfter = 1, championIds = None,
+                 divisionSize = divisionSize):
+        """
+        Local stand-in for the Riot Games API used by the benchmarks. Every response is made up from the
+        requested IDs so the same summoner always has the same rank.
+
+        Arguments:
+        latency - average seconds each request takes
+        jitter - standard deviation of the request time
+        rate429 - fraction of requests answered with 429 Too Many Requests
+        errorRate - fraction of requests answered with 500 Internal Server Error
+        retryAfter - the Retry-After value sent with 429 responses
+        championIds - the champion IDs to use for champion mastery responses
+        divisionSize - the number of players in each tier/division, registered summoners are placed at random among them
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate429 = rate429
+        self.errorRate = errorRate
+        self.retryAfter = retryAfter
+        self.championIds = championIds or [1, 2, 3]
+        self.calls = {}
+        self.divisionSize = divisionSize
+
+        # Registered summoners in each league keyed by their place in it. Every other place holds a player who
+        # never registered, so reading a league finds as few registered players as it would on a real platform.
+        self.leagues = {}
+        self.runner = None
+        self.url = None
+
+    def addSummoners(self, summonerIds):
+        """
+        Register summoners so they show up at random places in the tier/division pages and apex leagues
+        """
+        for summonerId in summonerIds:
+            tier, division, _, _, _ = rankFor(summonerId)
+            key = (tier, None) if tier in apexTiers else (tier, division)
+            league = self.leagues.setdefault(key, {})
+            size = max(self.getLeagueSize(tier), len(league) + 1)
+            place = random.randrange(size)
+            while place in league:
+                place = (place + 1) % size
+            league[place] = summonerId
+
+    def getLeagueSize(self, tier):
+        """
+        Get the number of players in a league of a tier
+        """
+        return apexSizes[tier] if tier in apexTiers else self.divisionSize
+
+    def getLeague(self, tier, division, start, end):
+        """
+        Get the league entries at places start to end of a league, made up for unregistered players
+        """
+        league = self.leagues.get((tier, division), {})
+        size = max(self.getLeagueSize(tier), max(league, default = -1) + 1)
+        entries = []
+        for place in range(start, min(end, size)):
+            if place in league:
+                entries.append(self.entryFor(league[place]))
+            else:
+                entries.append({"leagueId": f"{tier}-{division}", "summonerId": f"unregistered-{tier}-{division}-{place}",
+                                "queueType": "RANKED_SOLO_5x5", "tier": tier, "rank": division or "I",
+                                "leaguePoints": place % 100, "wins": 50, "losses": 50})
+        return entries
+
+    def getCallCount(self):
+        """
+        Get the total number of requests received
+        """
+        return sum(self.calls.values())
+
+    def entryFor(self, summonerId, queue = "RANKED_SOLO_5x5"):
+        tier, division, lp, wins, losses = rankFor(summonerId)
+        return {"leagueId": f"{tier}-{division}", "summonerId": summonerId, "queueType": queue, "tier": tier,
+                "rank": division, "leaguePoints": lp, "wins": wins, "losses": losses}
+
+    @web.middleware
+    async def simulate(self, request, handler):
+        # Count the request, wait like a real API would and sometimes fail
+        name = request.match_info.route.name
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(max(0, random.gauss(self.latency, self.jitter)))
+        headers = {"X-App-Rate-Limit": "100000:1", "X-App-Rate-Limit-Count": "1:1"}
+        roll = random.random()
+        if roll < self.rate429:
+            return web.json_response({"status": {"status_code": 429}}, status = 429,
+                                     headers = {**headers, "Retry-After": str(self.retryAfter), "X-Rate-Limit-Type": "application"})
+        if roll < self.rate429 + self.errorRate:
+            return web.json_response({"status": {"status_code": 500}}, status = 500, headers = headers)
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    async def account(self, request):
+        name, tag = request.match_info["name"], request.match_info["tag"]
+        return web.json_response({"puuid": f"puuid-{name.lower()}-{tag.lower()}", "gameName": name, "tagLine": tag})
+
+    async def summoner(self, request):
+        puuid = request.match_info["puuid"]
+        return web.json_response({"id": f"summoner-{puuid}", "accountId": f"account-{puuid}", "puuid": puuid,
+                                  "profileIconId": 1, "summonerLevel": 100})
+
+    async def entries(self, request):
+        return web.json_response([self.entryFor(request.match_info["summonerId"])])
+
+    async def division(self, request):
+        tier, division = request.match_info["tier"], request.match_info["division"]
+        page = int(request.query.get("page", 1))
+        return web.json_response(self.getLeague(tier, division, (page - 1) * pageSize, page * pageSize))
+
+    async def apex(self, request):
+        tier = request.match_info["tier"].upper()
+        entries = self.getLeague(tier, None, 0, self.getLeagueSize(tier))
+        return web.json_response({"leagueId": tier, "tier": tier, "queue": request.match_info["queue"], "entries": entries})
+
+    async def masteries(self, request):
+        count = int(request.query.get("count", 3))
+        return web.json_response([{"puuid": request.match_info["puuid"], "championId": championId, "championLevel": 7,
+                                   "championPoints": 100000} for championId in self.championIds[:count]])
+
+    async def start(self, port = 0):
+        """
+        Start the server on localhost
+
+        Arguments:
+        port - the port to listen on, 0 to pick a free port
+
+        Returns:
+        url - the base URL of the server
+        """
+        app = web.Application(middlewares = [self.simulate])
+        app.router.add_get("/riot/account/v1/accounts/by-riot-id/{name}/{tag}", self.account, name = "account-v1.by-riot-id")
+        app.router.add_get("/lol/summoner/v4/summoners/by-puuid/{puuid}", self.summoner, name = "summoner-v4.by-puuid")
+        app.router.add_get("/lol/league/v4/entries/by-summoner/{summonerId}", self.entries, name = "league-v4.entries-by-summoner")
+        app.router.add_get("/lol/league/v4/entries/{queue}/{tier}/{division}", self.division, name = "league-v4.entries-by-division")
+        app.router.add_get(r"/lol/league/v4/{tier:\w+}leagues/by-queue/{queue}", self.apex, name = "league-v4.apex")
+        app.router.add_get("/lol/champion-mastery/v4/champion-masteries/by-puuid/{puuid}/top", self.masteries,
+                           name = "champion-mastery-v4.top-by-puuid")
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self):
+        """
+        Stop the server
+        """
+        await self.runner.cleanup()
@@ -0,0 +1,72 @@
+"""
+Check that a database created by the first version of the bot, before Riot Games accounts and rank history
+were stored separately, is upgraded to the latest schema with its players kept.
+
+Run from the main folder with:
+
+    python3 benchmarks/upgradecheck.py
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+# Make the bot's modules importable when running from the main folder or from benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+# The users table as the first version of the bot created it, with one registered player
+baselineSchema = """
+CREATE TABLE users (
+    "discordId" INTEGER NOT NULL, "serverId" INTEGER NOT NULL, username VARCHAR, tag VARCHAR, "puuID" VARCHAR,
+    "summonerID" VARCHAR, "accountID" VARCHAR, "startRank" VARCHAR, "startDivision" VARCHAR, "startLP" INTEGER,
+    "startValue" INTEGER, "currRank" VARCHAR, "currDivision" VARCHAR, "currLP" INTEGER, "currValue" INTEGER,
+    "valueChange" INTEGER, PRIMARY KEY ("discordId", "serverId")
+);
+INSERT INTO users VALUES (1, 10, 'Player', 'NA1', 'puuid-player', 'summoner-player', 'account-player',
+                          'GOLD', 'II', 10, 1410, 'GOLD', 'I', 20, 1520, 110);
+"""
+
+async def upgrade():
+    """
+    Upgrade the database and read the player back through the latest models
+
+    Returns:
+    player, account, history - the upgraded User, its RiotAccount and its rank history
+    """
+    import database
+    import users
+    from sqlalchemy import select
+    await database.init()
+    async with database.Session() as session:
+        player = await session.get(users.User, (1, 10))
+        account = await session.get(users.RiotAccount, "puuid-player")
+        history = (await session.scalars(select(users.RankHistory))).all()
+    await database.close()
+    return player, account, history
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark.configure(directory)
+        connection = sqlite3.connect(os.path.join(directory, "benchmark.db"))
+        connection.executescript(baselineSchema)
+        connection.close()
+
+        player, account, history = asyncio.run(upgrade())
+        problems = []
+        if player is None or (player.platform, player.queue, player.currValue) != ("na1", "RANKED_SOLO_5x5", 1520):
+            problems.append("the registered player was not kept")
+        if account is None or (account.platform, account.currRank, account.currLP) != ("na1", "GOLD", 20):
+            problems.append("the player's Riot Games account was not created")
+        if [(entry.queue, entry.value) for entry in history] != [("RANKED_SOLO_5x5", 1520)]:
+            problems.append("the rank history was not started")
+    for problem in problems:
+        print(f"Upgrade problem: {problem}")
+    if len(problems) > 0:
+        sys.exit(1)
+    print("Baseline database upgraded to the latest schema")
+
+if __name__ == "__main__":
+    main()
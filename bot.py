@@ -1,25 +1,312 @@
+import time
+
+# Time the process started loading the bot, taken before the other imports so they count towards the startup time
+startTime = time.monotonic()
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
 import discord
 from discord import app_commands
 from discord.ext import commands
 from constants import DISCORD_TOKEN
 import commands
+import riot
+import users
+import refresher
+import database
+import history
+import leaderboards
+import champions
+import charts
+import metrics
+import roster
+import config
 from pagination import Pagination
 
-def run():
-    # Sets up client/bot and command tree
-    client = discord.Client(intents = discord.Intents.default())
-    tree = discord.app_commands.CommandTree(client)
+logger = logging.getLogger(__name__)
+
+class LeagueBot(discord.AutoShardedClient):
+    def __init__(self, forceSync = False, **options):
+        """
+        The bot's sharded client, which owns the slash command tree and times each stage of starting up
+
+        Arguments:
+        forceSync - whether to sync the slash commands with Discord even if they did not change
+        options - options passed to discord.AutoShardedClient
+        """
+        super().__init__(**options)
+        self.tree = app_commands.CommandTree(self)
+        self.forceSync = forceSync
+
+        # Background tasks and the metrics endpoint, started by setup_hook. They stay None if starting up fails
+        # before reaching them, since close is still called then.
+        self.championTask = None
+        self.metricsServer = None
+        self.refreshTask = None
+        self.lagTask = None
+        self.warmUpTask = None
+
+        # Seconds taken by each stage of starting up, in order
+        self.startupTimings = {}
+        self.stageStart = startTime
+        self.finishStage("imports")
+
+    def finishStage(self, stage):
+        """
+        Record how long a stage of starting up took, from the end of the previous stage until now
+
+        Arguments:
+        stage - the name of the stage that finished
+        """
+        now = time.monotonic()
+        self.startupTimings[stage] = now - self.stageStart
+        self.stageStart = now
+
+    def isPrimary(self):
+        """
+        Check whether this process runs shard 0. When the bot is split across several processes only the
+        primary process syncs the slash commands and compacts the rank history.
+        """
+        return self.shard_ids is None or 0 in self.shard_ids
+
+    async def setup_hook(self):
+        """
+        Set up the database, sync the slash commands if they changed, start refreshing player ranks in the
+        background and optionally start the chart rendering processes once the bot has logged in
+        """
+        self.finishStage("login")
+        await database.init()
+        self.finishStage("database")
+
+        # Load the champion index in the background so the first /info does not wait for it
+        self.championTask = asyncio.create_task(champions.loadIndex())
+
+        # Every process serves its metrics on its own port, offset by its first shard ID
+        if config.METRICS_PORT is not None:
+            self.metricsServer = await metrics.startServer(port = config.METRICS_PORT + min(self.shard_ids or [0]))
+        self.finishStage("metricsServer")
+
+        if self.isPrimary():
+            await syncCommands(self.tree, self.application_id, self.forceSync)
+            self.finishStage("commandSync")
+
+        self.refreshTask = asyncio.create_task(refresher.run(compact = self.isPrimary()))
+        self.lagTask = asyncio.create_task(metrics.monitorLoopLag())
+        if config.CHART_WARM_UP:
+            self.warmUpTask = asyncio.create_task(charts.warmUp())
+
+    def reportStartup(self):
+        """
+        Log how long each stage of starting up took and record it in the startup_seconds gauge
+        """
+        for stage, seconds in self.startupTimings.items():
+            metrics.setGauge("startup_seconds", seconds, {"stage": stage})
+        logger.info("Started in %.2fs (%s)", sum(self.startupTimings.values()),
+                    ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.startupTimings.items()))
+
+    async def close(self):
+        """
+        Stop the background tasks and the metrics endpoint and close the shared Riot Games API and database
+        connection pools before shutting down the bot
+        """
+        for task in [self.championTask, self.refreshTask, self.lagTask, self.warmUpTask]:
+            if task is not None:
+                task.cancel()
+        if self.metricsServer is not None:
+            await self.metricsServer.cleanup()
+        await riot.client.close()
+        await database.close()
+        charts.executor.shutdown(wait = False, cancel_futures = True)
+        await super().close()
+
+def getCommandHash(tree, applicationId):
+    """
+    Get a hash of the slash command definitions, which changes whenever a command, option or choice is
+    added, removed or edited
+
+    Arguments:
+    tree - the command tree
+    applicationId - the ID of the bot's Discord application, so switching bots also counts as a change
+    """
+    definitions = sorted((command.to_dict(tree) for command in tree.get_commands()), key = lambda command: command["name"])
+    return hashlib.sha256(json.dumps([applicationId, definitions], sort_keys = True).encode()).hexdigest()
+
+async def syncCommands(tree, applicationId, force = False):
+    """
+    Sync the slash commands with Discord if their definitions changed since the last sync, storing the hash
+    of the synced definitions in COMMAND_HASH_PATH
+
+    Arguments:
+    tree - the command tree
+    applicationId - the ID of the bot's Discord application
+    force - whether to sync even if the definitions did not change
+
+    Returns:
+    synced - whether the commands were synced
+    """
+    commandHash = getCommandHash(tree, applicationId)
+    if not force and os.path.exists(config.COMMAND_HASH_PATH):
+        with open(config.COMMAND_HASH_PATH, encoding = "utf8") as f:
+            if f.read().strip() == commandHash:
+                logger.info("Bot commands unchanged, skipping sync")
+                return False
+
+    logger.info("Bot commands are loading...")
+    try:
+        synced = await tree.sync()
+    except Exception as e:
+        logger.error("Synced 0 commands successfully: %s", e)
+        raise
+    with open(config.COMMAND_HASH_PATH, "w", encoding = "utf8") as f:
+        f.write(commandHash)
+    logger.info("Synced %d command(s) successfully", len(synced))
+    return True
+
+async def getUpdatedText(server):
+    """
+    Get the text describing how long ago the ranks in the server were updated
+
+    Arguments:
+    server - the server ID of the server
+    """
+    lastUpdated = await commands.getLastUpdated(server)
+    if lastUpdated is None:
+        return "Ranks not updated yet"
+    minutes = int((time.time() - lastUpdated) // 60)
+    if minutes == 0:
+        return "Updated just now"
+    return f"Updated {minutes} minute{'s' if minutes != 1 else ''} ago"
+
+# Leaderboard refreshes still running after the leaderboard was shown, kept so they are not garbage collected
+backgroundTasks = set()
+
+# The rank refresh running in each server, shared by every leaderboard shown while it runs
+serverRefreshes = {}
+
+def getServerRefresh(server, maxAge):
+    """
+    Get the rank refresh running in the server, starting one if none is running
+
+    Arguments:
+    server - the server ID of the server
+    maxAge - ignore cached ranks older than this many seconds when a refresh is started (None to use the cache)
+
+    Returns:
+    task - the task of the refresh, returning the players that could not be updated
+    """
+    task = serverRefreshes.get(server)
+    if task is None:
+        task = asyncio.create_task(commands.updateRanks(server, maxAge = maxAge))
+        serverRefreshes[server] = task
+        task.add_done_callback(lambda _: serverRefreshes.pop(server, None))
+    return task
 
-    # Starts the bot and syncs commands
+async def showLeaderboard(interaction: discord.Interaction, column: str, refresh: bool):
+    """
+    Show a server leaderboard straight away from the last known ranks. When asked to, or when the ranks are
+    older than BACKGROUND_REFRESH_STALE_AFTER, the ranks are refreshed in the background and the message is
+    edited in place once the fresher ranks arrive. A leaderboard shown while the server is already being
+    refreshed waits for that refresh instead of starting another.
+
+    Arguments:
+    interaction - the interaction of the command
+    column - the leaderboard to show (leaderboards.IMPROVEMENT or leaderboards.RANK)
+    refresh - whether to fetch the latest ranks from Riot Games even if they are recent
+    """
+    await interaction.response.defer()
+    server = interaction.guild.id
+    refresher.markActive(server)
+    lastUpdated = await commands.getLastUpdated(server)
+    stale = lastUpdated is None or time.time() - lastUpdated > config.BACKGROUND_REFRESH_STALE_AFTER
+
+    # Count the players once per version of the message so every page of it uses the same number of pages
+    elementsPerPage = 5
+    state = {"total": await commands.getLeaderboardSize(server), "updatedText": await getUpdatedText(server),
+             "refreshing": refresh or stale or server in serverRefreshes, "failed": commands.lastFailed.get(server, [])}
+    async def get_page(page: int):
+
+        # Get the rendered page of the leaderboard and add the footer to a copy of it
+        embed = (await commands.getLeaderboardEmbed(server, column, page, elementsPerPage)).copy()
+        pages = Pagination.getPageCount(state["total"], elementsPerPage)
+        footer = f"Page {page} from {pages} • {state['updatedText']}"
+        if state["refreshing"]:
+            footer += " • Refreshing ranks..."
+        elif len(state["failed"]) > 0:
+            footer += f" • {len(state['failed'])} player(s) could not be updated"
+        embed.set_footer(text = footer)
+        return embed, pages
+
+    view = Pagination(interaction, get_page)
+    await view.navigate()
+    if not state["refreshing"]:
+        return
+
+    async def revalidate():
+        try:
+            state["failed"] = await asyncio.shield(getServerRefresh(server, 0 if refresh else None))
+        except Exception:
+            logger.exception("Background leaderboard refresh failed in server %s", server)
+        state["refreshing"] = False
+        try:
+            state["total"] = await commands.getLeaderboardSize(server)
+            state["updatedText"] = await getUpdatedText(server)
+            await view.refresh()
+        except Exception:
+            logger.exception("Could not update the leaderboard message in server %s", server)
+
+    task = asyncio.create_task(revalidate())
+    backgroundTasks.add(task)
+    task.add_done_callback(backgroundTasks.discard)
+
+async def sendError(interaction: discord.Interaction, error: Exception):
+    """
+    Log an error from a command, count it in the metrics and send its message to the user
+
+    Arguments:
+    interaction - the interaction of the command that failed
+    error - the exception raised by the command
+    """
+    command = interaction.command.name if interaction.command is not None else "unknown"
+    logger.warning("/%s failed in server %s: %s", command, interaction.guild_id, error)
+    metrics.increment("command_errors_total", {"command": command})
+    if interaction.response.is_done():
+        await interaction.followup.send(error)
+    else:
+        await interaction.response.send_message(error)
+
+def run(shardCount = config.SHARD_COUNT, shardIds = config.SHARD_IDS, forceSync = False):
+    """
+    Start the bot. By default Discord decides the number of shards and every shard runs in this process.
+    To split the bot across several processes, start each one with the same shard count and its own shard IDs.
+
+    Arguments:
+    shardCount - the total number of shards across every process, or None to use the number Discord recommends
+    shardIds - the shards this process runs, or None to run every shard
+    forceSync - whether to sync the slash commands with Discord even if they did not change
+    """
+    # Sets up client/bot and command tree. The commands are synced when the bot logs in.
+    client = LeagueBot(forceSync, intents = discord.Intents.default(), shard_count = shardCount, shard_ids = shardIds)
+    tree = client.tree
+
+    # Report how long starting up took the first time every shard is ready. on_ready fires again after
+    # reconnecting, which is not a restart.
     @client.event
     async def on_ready():
-        print("Bot commands are loading...")
-        try:
-            synced = await tree.sync()
-            print(f"Synced {len(synced)} command(s) successfully.\nBot is ready!")
-        except Exception as e:
-            print("Synced 0 commands successfully.")
-            exit()
+        logger.info("Shards %s are ready", ", ".join(str(shard) for shard in client.shards))
+        if "gateway" not in client.startupTimings:
+            client.finishStage("gateway")
+            client.reportStartup()
+
+    # Record how long each command took from being used to the bot finishing its response
+    @client.event
+    async def on_app_command_completion(interaction: discord.Interaction, command):
+        seconds = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        metrics.observe("command_seconds", seconds, {"command": command.name})
 
     # Temporary test command to ensure bot is connected and working
     @tree.command(name="hello", description="Says hello to you")
@@ -34,77 +321,53 @@ def run():
     divisionChoices = []
     for division in ["I", "II", "III", "IV"]:
         divisionChoices.append(discord.app_commands.Choice(name = division, value = division))
+    regionChoices = []
+    for platform, name in riot.platformNames.items():
+        regionChoices.append(discord.app_commands.Choice(name = name, value = platform))
+    queueChoices = []
+    for queue, name in users.queues.items():
+        queueChoices.append(discord.app_commands.Choice(name = name, value = queue))
 
     # Create registration command which allows users to register with the bot by putting in
     # their Riot Games account username and tag along with initial rank information
     @tree.command(name = "register", description = "Connect your league and discord accounts")
     @app_commands.describe(username = "Riot Games name", tag = "Riot Games tag", rank = "Choose your starting rank",
-                        division = "Choose your starting division", lp = "Choose your starting LP")
+                        division = "Choose your starting division", lp = "Choose your starting LP",
+                        region = "Region your account plays on (default North America)",
+                        queue = "Ranked queue to track (default Solo/Duo)")
     @app_commands.choices(rank = rankChoices)
     @app_commands.choices(division = divisionChoices)
-    async def register(interaction: discord.Interaction, username: str, tag: str, rank: str, division: str, lp: int):
+    @app_commands.choices(region = regionChoices)
+    @app_commands.choices(queue = queueChoices)
+    async def register(interaction: discord.Interaction, username: str, tag: str, rank: str, division: str, lp: int,
+                       region: str = "na1", queue: str = users.SOLO):
         try:
-            commands.register(interaction.user.id, interaction.guild.id, username, tag, rank, division, lp)
-            await interaction.response.send_message(f"Registered {interaction.user.mention} as {username}#{tag} with rank {rank} {division} {lp} LP")
+            await commands.register(interaction.user.id, interaction.guild.id, username, tag, rank, division, lp, region, queue)
+            await interaction.response.send_message(f"Registered {interaction.user.mention} as {username}#{tag} ({riot.platformNames[region]}) " +
+                                                    f"with {users.queues[queue]} rank {rank} {division} {lp} LP")
         except Exception as e:
-            await interaction.response.send_message(e)
+            await sendError(interaction, e)
 
     # Allows users to unregister from the bot in the server the command is run in
     @tree.command(name = "unregister", description = "Unregister your account from this bot in this server.")
     async def unregister(interaction: discord.Interaction):
         try:
-            commands.unregister(interaction.user.id, interaction.guild.id)
+            await commands.unregister(interaction.user.id, interaction.guild.id)
             await interaction.response.send_message(f"{interaction.user.mention} has been successfully unregistered")
         except Exception as e:
-            await interaction.response.send_message(e)
+            await sendError(interaction, e)
 
     # Creates a command to display the improvement leaderboard for the users in the discord server
     @tree.command(name = "leaderboard", description = "Display the rank improvement leaderboard for this server")
-    async def leaderboard(interaction: discord.Interaction):
-        await interaction.response.defer()
-        commands.updateRanks(interaction.guild.id)
-        async def get_page(page: int):
-
-            # Create the embed to display the improvement leaderboard
-            embed = discord.Embed(title = "Rank Improvement Leaderboard",
-                                description = "",
-                                color = discord.Color.from_str("#101539"))
-            embed.set_thumbnail(url = "https://i.imgur.com/0QKRQ5V.png")
-
-            elementsPerPage = 5
-            offset = (page - 1) * elementsPerPage
-            users = commands.getImprovementLeaderboard(interaction.guild.id)
-            for user in users[offset:offset + elementsPerPage]:
-                embed.description += f"{user}\n"
-            pages = Pagination.getPageCount(len(users), elementsPerPage)
-            embed.set_footer(text=f"Page {page} from {pages}")
-            return embed, pages
-
-        await Pagination(interaction, get_page).navigate()
+    @app_commands.describe(refresh = "Fetch the latest ranks from Riot Games and update the leaderboard when they arrive")
+    async def leaderboard(interaction: discord.Interaction, refresh: bool = False):
+        await showLeaderboard(interaction, leaderboards.IMPROVEMENT, refresh)
 
     # Creates a command to display the ranked leaderboard for users in the server
     @tree.command(name = "ranks", description = "Display the rank leaderboard for this server")
-    async def leaderboard(interaction: discord.Interaction):
-        await interaction.response.defer()
-        commands.updateRanks(interaction.guild.id)
-        async def get_page(page: int):
-
-            # Create embed to display the ranked leaderboard
-            embed = discord.Embed(title = "Rank Leaderboard",
-                                description = "",
-                                color = discord.Color.from_str("#101539"))
-            embed.set_thumbnail(url = "https://i.imgur.com/0QKRQ5V.png")
-
-            elementsPerPage = 5
-            offset = (page - 1) * elementsPerPage
-            users = commands.getRankLeaderboard(interaction.guild.id)
-            for user in users[offset:offset + elementsPerPage]:
-                embed.description += f"{user}\n"
-            pages = Pagination.getPageCount(len(users), elementsPerPage)
-            embed.set_footer(text=f"Page {page} from {pages}")
-            return embed, pages
-
-        await Pagination(interaction, get_page).navigate()
+    @app_commands.describe(refresh = "Fetch the latest ranks from Riot Games and update the leaderboard when they arrive")
+    async def ranks(interaction: discord.Interaction, refresh: bool = False):
+        await showLeaderboard(interaction, leaderboards.RANK, refresh)
 
     # Creates a command to display information associated with user's account
     @tree.command(name = "info", description = "Display user's information")
@@ -112,12 +375,86 @@ def run():
     async def info(interaction: discord.Interaction, user: str):
         try:
             await interaction.response.defer()
-            embed, file = commands.displayInfo(user, interaction.guild.id)
-            await interaction.followup.send(file = file, embed = embed)
+            refresher.markActive(interaction.guild.id)
+            embeds, files = await commands.displayInfo(user, interaction.guild.id)
+            await interaction.followup.send(files = files, embeds = embeds)
+        except Exception as e:
+            await sendError(interaction, e)
+
+    # Creates a command to display the player in the server who gained the most LP this week
+    @tree.command(name = "climber", description = "Display the player who gained the most LP this week")
+    async def climber(interaction: discord.Interaction):
+        try:
+            await interaction.response.defer()
+            refresher.markActive(interaction.guild.id)
+            player, gain = await history.getClimberOfTheWeek(interaction.guild.id)
+            if player is None:
+                await interaction.followup.send("Nobody in this server has gained LP this week")
+            else:
+                await interaction.followup.send(f"Climber of the week: <@{player.discordId}> ({player.username}) " +
+                                                f"with +{gain} LP, now {player.currRank} {player.currDivision} {player.currLP} LP")
+        except Exception as e:
+            await sendError(interaction, e)
+
+    # Creates an admin only command to display the bot's performance metrics
+    @tree.command(name = "stats", description = "Display the bot's performance metrics")
+    @app_commands.default_permissions(administrator = True)
+    @app_commands.guild_only()
+    async def stats(interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("Only server administrators can use this command", ephemeral = True)
+            return
+        await interaction.response.send_message(embed = commands.displayStats(), ephemeral = True)
+
+    # Creates an admin only command to register many players in the server at once from a CSV or JSON file
+    @tree.command(name = "import", description = "Register players in this server from a CSV or JSON file")
+    @app_commands.describe(file = "CSV or JSON with discordId, username, tag, rank, division, lp and optionally region, queue")
+    @app_commands.default_permissions(administrator = True)
+    @app_commands.guild_only()
+    async def importPlayers(interaction: discord.Interaction, file: discord.Attachment):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("Only server administrators can use this command", ephemeral = True)
+            return
+        try:
+            await interaction.response.defer(ephemeral = True)
+            if file.size > config.IMPORT_MAX_BYTES:
+                raise Exception(f"Import files can be at most {config.IMPORT_MAX_BYTES // 1000} KB")
+            records = roster.parseRoster(await file.read(), file.filename)
+            imported, failed = await roster.importPlayers(interaction.guild.id, records)
+            message = f"Imported {imported} player(s)"
+            if len(failed) > 0:
+                message += f", skipped {len(failed)}:\n{roster.formatFailures(failed)}"
+            await interaction.followup.send(message[:2000], ephemeral = True)
+        except Exception as e:
+            await sendError(interaction, e)
+
+    # Creates an admin only command to download the server's players and their rank history
+    @tree.command(name = "export", description = "Download this server's players and their rank history")
+    @app_commands.default_permissions(administrator = True)
+    @app_commands.guild_only()
+    async def export(interaction: discord.Interaction):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("Only server administrators can use this command", ephemeral = True)
+            return
+        try:
+            await interaction.response.defer(ephemeral = True)
+            with tempfile.TemporaryFile() as output:
+                players, changes = await roster.exportServer(interaction.guild.id, output)
+                output.seek(0)
+                await interaction.followup.send(f"Exported {players} player(s) and {changes} rank change(s)",
+                                                file = discord.File(output, filename = f"players-{interaction.guild.id}.jsonl"),
+                                                ephemeral = True)
         except Exception as e:
-            await interaction.followup.send(e)
+            await sendError(interaction, e)
 
-    client.run(DISCORD_TOKEN) # Run the bot
+    client.run(DISCORD_TOKEN, root_logger = True) # Run the bot
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "Run the League Tracker Bot")
+    parser.add_argument("--shard-count", dest = "shardCount", type = int, default = config.SHARD_COUNT,
+                        help = "total number of shards across every bot process")
+    parser.add_argument("--shard-ids", dest = "shardIds", type = int, nargs = "+", default = config.SHARD_IDS,
+                        help = "shards run by this process")
+    parser.add_argument("--sync", action = "store_true", help = "sync the slash commands even if they did not change")
+    arguments = parser.parse_args()
+    run(arguments.shardCount, arguments.shardIds, arguments.sync)
\ No newline at end of file
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import config
+import riot
+import ratelimit
+import users
+
+logger = logging.getLogger(__name__)
+
+apexTiers = ["MASTER", "GRANDMASTER", "CHALLENGER"]
+
+async def fetchRanks(accounts, priority = ratelimit.BACKGROUND):
+    """
+    Get the Solo/Duo league entries of many accounts at once by reading the apex leagues of their platform they
+    were last seen in, and the tier/division pages if BULK_READ_DIVISIONS is set. Accounts that are not found (for example because they changed division) have to
+    be fetched one at a time by the caller.
+
+    Arguments:
+    accounts - the list of RiotAccount objects to get the ranks of
+    priority - the rate limiter priority of the requests
+
+    Returns:
+    entries - a dictionary of summoner ID to league entry for the accounts that were found
+    """
+    # In-memory index of the summoner IDs being looked for, grouped by their platform and the league they were
+    # last seen in
+    groups = {}
+    for account in accounts:
+        if account.currRank in apexTiers:
+            key = (account.platform, account.currRank, None)
+        else:
+            key = (account.platform, account.currRank, account.currDivision)
+        groups.setdefault(key, set()).add(account.summonerID)
+    wanted = set(account.summonerID for account in accounts)
+    queue = users.SOLO
+    entries = {}
+
+    def match(entry, tier):
+        # Keep the entry if it belongs to one of the accounts being looked for
+        if entry["summonerId"] in wanted:
+            entries[entry["summonerId"]] = {"summonerId": entry["summonerId"], "queueType": queue, "tier": tier,
+                                            "rank": entry["rank"], "leaguePoints": entry["leaguePoints"],
+                                            "wins": entry["wins"], "losses": entry["losses"]}
+
+    async def readApex(platform, tier):
+        league = await riot.client.getApexLeague(tier, queue, platform, priority = priority)
+        for entry in league["entries"]:
+            match(entry, tier)
+
+    async def readDivision(platform, tier, division, summonerIDs):
+        # Read pages until every account from this division is found or the page limit is reached. Pages are in
+        # no useful order, so a page without any of the accounts means later pages are unlikely to have them.
+        for page in range(1, config.BULK_MAX_PAGES + 1):
+            response = await riot.client.getLeagueEntriesPage(queue, tier, division, page, platform, priority = priority)
+            before = len(entries)
+            for entry in response:
+                match(entry, entry["tier"])
+            if len(response) == 0 or summonerIDs.issubset(entries) or len(entries) == before:
+                break
+
+    reads = []
+    for (platform, tier, division), summonerIDs in groups.items():
+        if tier in apexTiers and len(summonerIDs) >= config.BULK_MIN_APEX_PLAYERS:
+            reads.append(readApex(platform, tier))
+        elif config.BULK_READ_DIVISIONS and tier in users.ranks and len(summonerIDs) >= config.BULK_MIN_PLAYERS:
+            reads.append(readDivision(platform, tier, division, summonerIDs))
+
+    # A league that cannot be read only means its accounts are fetched one at a time instead
+    for result in await asyncio.gather(*reads, return_exceptions = True):
+        if isinstance(result, Exception):
+            logger.warning("Error reading league in bulk: %s", result)
+    return entries
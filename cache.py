@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    def __init__(self, ttl: float, maxSize: int):
+        """
+        Least recently used cache whose entries expire after a number of seconds. Concurrent lookups
+        of a missing key share one call to the fetch function instead of each making their own.
+
+        Arguments:
+        ttl - number of seconds an entry stays valid
+        maxSize - the maximum number of entries kept, the least recently used entry is dropped first
+        """
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.inflight = {}
+
+        # Counters exposed as metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key, maxAge: float = None):
+        """
+        Get the cached value for a key, or None if it is missing or expired
+
+        Arguments:
+        key - the key to look up
+        maxAge - optionally treat entries older than this many seconds as expired
+        """
+        if key not in self.entries:
+            return None
+        storedAt, value = self.entries[key]
+        age = time.monotonic() - storedAt
+        if age > self.ttl or (maxAge is not None and age > maxAge):
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value in the cache, dropping the least recently used entries if the cache is full
+
+        Arguments:
+        key - the key to store the value under
+        value - the value to store
+        """
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+
+    def invalidate(self, key):
+        """
+        Remove a key from the cache
+        """
+        self.entries.pop(key, None)
+
+    async def getOrFetch(self, key, fetch, maxAge: float = None):
+        """
+        Get the cached value for a key, calling fetch() to get and store it on a miss
+
+        Arguments:
+        key - the key to look up
+        fetch - coroutine function called with no arguments to get the value on a miss
+        maxAge - optionally treat entries older than this many seconds as expired
+        """
+        value = self.get(key, maxAge)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        # Join a fetch for the same key that is already in progress, otherwise start one. The fetch runs as
+        # its own task so a caller that is cancelled does not cancel it for everyone else waiting on it.
+        if key in self.inflight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            self.inflight[key] = asyncio.ensure_future(fetch())
+            self.inflight[key].add_done_callback(lambda task: self.finishFetch(key, task))
+        return await asyncio.shield(self.inflight[key])
+
+    def finishFetch(self, key, task):
+        """
+        Store the result of a finished fetch. Failed fetches are not cached.
+        """
+        del self.inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result())
+
+    def getStats(self):
+        """
+        Get the cache counters
+
+        Returns:
+        stats - a dictionary with the number of hits, misses, coalesced lookups and stored entries
+        """
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self.entries)}
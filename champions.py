@@ -1,35 +1,158 @@
+import asyncio
 import os
+import re
 import json
-import requests
-import constants
+import tarfile
+import riot
+import config
 
-# Get the champion name from the champion ID and make a dictionarry
-# for all champions where the key is champion id and value is champion name
-championsByID = { }
-for file in os.listdir("./champion"):
-    f = open(f"./champion/{file}", encoding="utf8")
-    champion = file.split(".")[0]
-    data = json.load(f)
-    id = (data["data"][champion]["key"])
-    championsByID[id] = champion
+# Compact champion index ({"version": patch, "champions": {champion id: {"name": name, "icon": icon file}}}),
+# loaded the first time it is needed
+index = None
 
-def getBestChampions(puuID):
+# Load of the index running in a worker thread, shared by everything waiting for it
+loading = None
+
+def findTarball():
+    """
+    Find the newest Data Dragon tarball in DATA_DRAGON_DIRECTORY
+
+    Returns:
+    path, version - the path of the tarball and its patch version, or (None, None) if there is no tarball
+    """
+    tarballs = []
+    for file in os.listdir(config.DATA_DRAGON_DIRECTORY):
+        match = re.match(r"^dragontail-(\d+(?:\.\d+)+)\.tgz$", file)
+        if match is not None:
+            version = match.group(1)
+            tarballs.append(([int(part) for part in version.split(".")], os.path.join(config.DATA_DRAGON_DIRECTORY, file), version))
+    if len(tarballs) == 0:
+        return None, None
+    _, path, version = max(tarballs)
+    return path, version
+
+def getSourceVersion():
+    """
+    Get the patch version of the available champion data without parsing all of it
+
+    Returns:
+    version - the patch version, or None if no champion data is available
+    """
+    path, version = findTarball()
+    if path is not None:
+        return version
+    if os.path.isdir(config.CHAMPION_DIRECTORY):
+        for file in os.listdir(config.CHAMPION_DIRECTORY):
+            with open(os.path.join(config.CHAMPION_DIRECTORY, file), encoding = "utf8") as f:
+                return json.load(f)["version"]
+    return None
+
+def buildIndex():
+    """
+    Build the champion index from the Data Dragon tarball, or from the extracted champion JSON files
+    if there is no tarball
+
+    Returns:
+    index - the champion index
+    """
+    champions = {}
+    path, version = findTarball()
+    if path is not None:
+        # The tarball has a summary file with every champion, so only that one file needs to be read
+        with tarfile.open(path) as tarball:
+            data = json.load(tarball.extractfile(f"{version}/data/en_US/champion.json"))
+        for champion in data["data"].values():
+            champions[champion["key"]] = {"name": champion["name"], "icon": champion["image"]["full"]}
+    else:
+        for file in os.listdir(config.CHAMPION_DIRECTORY):
+            with open(os.path.join(config.CHAMPION_DIRECTORY, file), encoding = "utf8") as f:
+                data = json.load(f)
+            version = data["version"]
+            champion = data["data"][file.split(".")[0]]
+            champions[champion["key"]] = {"name": champion["name"], "icon": champion["image"]["full"]}
+    return {"version": version, "champions": champions}
+
+def getIndex():
+    """
+    Get the champion index, loading it on first use and rebuilding the stored index if the
+    champion data is from a different patch
+    """
+    global index
+    if index is None:
+        stored = None
+        if os.path.exists(config.CHAMPION_INDEX_PATH):
+            with open(config.CHAMPION_INDEX_PATH, encoding = "utf8") as f:
+                stored = json.load(f)
+        version = getSourceVersion()
+        if stored is not None and (version is None or stored["version"] == version):
+            index = stored
+        else:
+            index = buildIndex()
+            with open(config.CHAMPION_INDEX_PATH, "w", encoding = "utf8") as f:
+                json.dump(index, f)
+    return index
+
+async def loadIndex():
+    """
+    Load the champion index in a worker thread so reading the champion data, which can mean decompressing a
+    Data Dragon tarball, never blocks the event loop. Called when the bot starts and before the index is read
+    from async code; concurrent calls share one load.
+    """
+    global loading
+    if index is not None:
+        return index
+    if loading is None:
+        loading = asyncio.ensure_future(asyncio.to_thread(getIndex))
+    try:
+        return await asyncio.shield(loading)
+    finally:
+        if loading is not None and loading.done():
+            loading = None
+
+def getVersion():
+    """
+    Get the patch version of the champion data, used for Data Dragon image URLs
+    """
+    return getIndex()["version"]
+
+def getChampionName(championId):
+    """
+    Get the name of a champion from its ID
+
+    Arguments:
+    championId - the champion's ID
+    """
+    return getIndex()["champions"][str(championId)]["name"]
+
+def getChampionIconUrl(championId):
+    """
+    Get the Data Dragon URL of a champion's icon
+
+    Arguments:
+    championId - the champion's ID
+    """
+    icon = getIndex()["champions"][str(championId)]["icon"]
+    return f"https://ddragon.leagueoflegends.com/cdn/{getVersion()}/img/champion/{icon}"
+
+async def getBestChampions(puuID, platform = "na1"):
     """
     Gets the top three most played champions for a user
 
     Arguments:
     puuID - the user;s puuID, used for Riot Games API call the get champion information
+    platform - the platform the user plays on
 
     Returns:
     champions - a list of the top three most played champions as strings
     """
     # Calls the Riot Games API to get champion master ifnormation for the user. Converts the champion ID response
     # to champion name as a string and appends it to the list
-    response = requests.get(f"https://na1.api.riotgames.com/lol/champion-mastery/v4/champion-masteries/by-puuid/{puuID}/top?count=3&api_key={constants.RIOT_KEY}")
-    if response.status_code != 200:
+    try:
+        response = await riot.client.getTopMasteries(puuID, 3, platform)
+    except riot.RiotAPIError:
         raise Exception("Error getting champion mastery from Riot Games")
-    response = response.json()
+    await loadIndex()
     champions = []
     for entry in response:
-        champions.append(championsByID[str(entry["championId"])])
+        champions.append(getChampionName(entry["championId"]))
     return champions
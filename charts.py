@@ -0,0 +1,115 @@
+import asyncio
+import io
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cache
+import config
+import metrics
+
+# Worker processes for rendering so charts are never drawn on the event loop and rendering is not limited to
+# the core running the bot. Every shard in the process shares the pool. Workers are spawned rather than
+# forked since forking a process with running threads is not safe. Matplotlib is only imported by the render
+# functions, so it is loaded by the workers when they draw their first chart and never by the bot itself.
+executor = ProcessPoolExecutor(max_workers = config.CHART_WORKERS, mp_context = multiprocessing.get_context("spawn"))
+
+# Rendered charts keyed by (wins, losses). The same record always gives the same chart so entries never expire.
+chartCache = cache.TTLCache(float("inf"), config.CHART_CACHE_SIZE)
+
+def renderWinrateChart(wins, losses):
+    """
+    Draw a donut chart of the user's winrate and return it as PNG data
+
+    Arguments:
+    wins - the number of ranked wins
+    losses - the number of ranked losses
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Circle
+
+    # Setup a pie chart to display winrate. The Figure is created directly rather than through pyplot
+    # so no global state is shared between charts rendered at the same time.
+    data = [wins, losses]
+    colors = ["#3469d1", "#d13434"]
+
+    fig = Figure(figsize = (1.5, 1.5), facecolor = "#2b2d31")
+    ax = fig.subplots()
+    ax.pie(data, colors = colors, startangle = 90)
+    ax.add_artist(Circle((0, 0), 0.8, fc = "#2b2d31"))
+
+    ax.text(0, 0, (format(wins/(wins + losses), ".0%")), ha = "center", va = "center", color = "white", fontsize = 16)
+    ax.axis("equal")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = "png")
+    return buffer.getvalue()
+
+async def getWinrateChart(wins, losses):
+    """
+    Get the PNG data of the winrate chart, rendering it in a worker process unless the same chart was already rendered
+
+    Arguments:
+    wins - the number of ranked wins
+    losses - the number of ranked losses
+    """
+    async def render():
+        with metrics.span("chart_render", chart = "winrate"):
+            return await asyncio.get_running_loop().run_in_executor(executor, renderWinrateChart, wins, losses)
+    return await chartCache.getOrFetch((wins, losses), render)
+
+def renderHistoryChart(history):
+    """
+    Draw a line chart of the user's rank value over time and return it as PNG data
+
+    Arguments:
+    history - a list of (timestamp, value) pairs ordered from oldest to newest
+    """
+    from matplotlib.figure import Figure
+
+    times = [datetime.datetime.fromtimestamp(timestamp) for timestamp, _ in history]
+    values = [value for _, value in history]
+
+    fig = Figure(figsize = (4, 1.5), facecolor = "#2b2d31")
+    ax = fig.subplots()
+    ax.set_facecolor("#2b2d31")
+    ax.plot(times, values, color = "#3469d1", marker = "o", markersize = 3)
+    ax.tick_params(colors = "white", labelsize = 7)
+    for spine in ax.spines.values():
+        spine.set_color("#5c5f66")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = "png")
+    return buffer.getvalue()
+
+async def getHistoryChart(puuID, history):
+    """
+    Get the PNG data of the rank history chart, rendering it in a worker process unless the same history was
+    already rendered
+
+    Arguments:
+    puuID - the puuID of the account the history belongs to
+    history - a list of (timestamp, value) pairs ordered from oldest to newest
+    """
+    async def render():
+        with metrics.span("chart_render", chart = "history"):
+            return await asyncio.get_running_loop().run_in_executor(executor, renderHistoryChart, history)
+    return await chartCache.getOrFetch(("history", puuID, len(history), history[-1]), render)
+
+def collectMetrics():
+    """
+    Get the chart cache usage as metric gauges
+    """
+    return [(f"chart_cache_{stat}", None, value) for stat, value in chartCache.getStats().items()]
+
+metrics.addCollector(collectMetrics)
+
+async def warmUp():
+    """
+    Start the worker processes and load matplotlib in them so the first charts are not slowed down by it.
+    Only called when the bot starts if CHART_WARM_UP is set, otherwise the first /info starts them.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(executor, renderWinrateChart, 1, 1) for _ in range(config.CHART_WORKERS)])
@@ -0,0 +1,77 @@
+import time
+import config
+
+# States of a circuit breaker
+CLOSED = "closed"       # requests are sent as usual
+OPEN = "open"           # requests are refused without being sent
+HALF_OPEN = "half-open" # one trial request is sent to check whether the service is back
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = config.CIRCUIT_FAILURE_THRESHOLD, resetTimeout: float = config.CIRCUIT_RESET_TIMEOUT):
+        """
+        Circuit breaker which stops sending requests to a service that keeps failing. After threshold failures
+        in a row the circuit opens and requests are refused straight away. Once resetTimeout seconds have passed
+        one trial request is let through: the circuit closes again if it succeeds and stays open for another
+        resetTimeout seconds if it fails.
+
+        Arguments:
+        threshold - the number of failures in a row that open the circuit
+        resetTimeout - seconds the circuit stays open before a trial request is sent
+        """
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt = None
+        self.trialStartedAt = None
+
+        # Counters exposed as metrics
+        self.opened = 0
+        self.rejected = 0
+
+    def getState(self):
+        """
+        Get the state of the circuit (CLOSED, OPEN or HALF_OPEN)
+        """
+        if self.openedAt is None:
+            return CLOSED
+        if time.monotonic() - self.openedAt < self.resetTimeout:
+            return OPEN
+        return HALF_OPEN
+
+    def allow(self):
+        """
+        Check whether a request can be sent, counting it as the trial request if the circuit is half open
+
+        Returns:
+        allowed - False if the request should be refused without being sent
+        """
+        state = self.getState()
+        if state == CLOSED:
+            return True
+
+        # Only one trial request at a time. A trial that never reported back (for example because it was
+        # cancelled) is replaced after resetTimeout seconds so the circuit cannot stay open forever.
+        now = time.monotonic()
+        if state == HALF_OPEN and (self.trialStartedAt is None or now - self.trialStartedAt >= self.resetTimeout):
+            self.trialStartedAt = now
+            return True
+        self.rejected += 1
+        return False
+
+    def recordSuccess(self):
+        """
+        Record a request that reached the service, closing the circuit
+        """
+        self.failures = 0
+        self.openedAt = None
+        self.trialStartedAt = None
+
+    def recordFailure(self):
+        """
+        Record a failed request, opening the circuit after threshold failures in a row or a failed trial request
+        """
+        self.failures += 1
+        if self.trialStartedAt is not None or (self.openedAt is None and self.failures >= self.threshold):
+            self.openedAt = time.monotonic()
+            self.trialStartedAt = None
+            self.opened += 1
@@ -1,52 +1,116 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+import asyncio
+import io
+import logging
+import time
 import users
 import re
-import requests
-import constants
+import riot
+import ratelimit
+import bulk
+import config
+import coordinator
+import database
 import discord
-import matplotlib.pyplot as plt
 import champions
+import charts
+import history
+import leaderboards
+import metrics
 
-# Create the database session for storing and accessing user information
-engine = create_engine("sqlite:///database.db", echo = False)
-users.Base.metadata.create_all(bind = engine)
+logger = logging.getLogger(__name__)
 
-Session = sessionmaker(bind = engine)
-session = Session()
+# Time each server's ranks were last refreshed by this process, so a player whose rank keeps failing to update
+# does not make the server's ranks look out of date forever. Only refreshes that updated players are recorded.
+lastRefreshed = {}
 
+# Players each server's last refresh could not update, shown on leaderboards until a later refresh
+lastFailed = {}
 
-def register(discordId, serverId, username, tag, rank, division, lp):
+
+def checkRegistration(tag, rank, division, lp, platform = "na1", queue = users.SOLO):
     """
-    Register a user to the bot by adding them to the database
+    Check the information entered to register a user, raising an exception describing the first problem found
 
     Arguments:
-    discordId - the discord ID of the user
-    serverId - the ID of the server where the user is registering
-    username - the username for the user's Riot Games account
     tag - the unique identifier tag associated with the user's Riot Games account
     rank - the starting rank of the user
     division - the starting division of the user
     lp - starting LP of the user
+    platform - the platform the user's account plays on
+    queue - the ranked queue to track
     """
-    # Check whether or not the user is already registered in the server. If yes raise an exception
-    if (session.query(users.User).filter_by(discordId = discordId, serverId = serverId).first()) is not None:
-        raise Exception("User already registered in this server")
-    
     # Check that the entered tag is valid (3-5 alphanumeric characters)
     if re.match(r"^[a-zA-Z0-9]{3,5}$", tag) is None:
         raise Exception("Entered tag format is incorrect")
-    
+
+    # Check that the starting rank is one of the choices offered by /register
+    if rank not in users.ranks or division not in users.divisions:
+        raise Exception("Please enter a valid rank and division")
+
     # Check that the entered starting LP is valid (between 0 and 99 inclusive)
     if lp > 99 or lp < 0:
         raise Exception("Please enter a valid LP between 0 and 99")
-    
-    # If the input information is correct, create the user and add them to the databse
-    newUser = users.User(discordId, serverId, username, tag, rank, division, lp)
-    session.add(newUser)
-    session.commit()
 
-def unregister(discId, servId):
+    if platform not in riot.platforms:
+        raise Exception("Please enter a valid region")
+    if queue not in users.queues:
+        raise Exception("Please enter a valid queue")
+
+async def register(discordId, serverId, username, tag, rank, division, lp, platform = "na1", queue = users.SOLO):
+    """
+    Register a user to the bot by adding them to the database
+
+    Arguments:
+    discordId - the discord ID of the user
+    serverId - the ID of the server where the user is registering
+    username - the username for the user's Riot Games account
+    tag - the unique identifier tag associated with the user's Riot Games account
+    rank - the starting rank of the user
+    division - the starting division of the user
+    lp - starting LP of the user
+    platform - the platform the user's account plays on
+    queue - the ranked queue to track in this server (users.SOLO or users.FLEX)
+    """
+    async with database.Session() as session:
+        # Check whether or not the user is already registered in the server. If yes raise an exception
+        if await session.get(users.User, (discordId, serverId)) is not None:
+            raise Exception("User already registered in this server")
+        checkRegistration(tag, rank, division, lp, platform, queue)
+
+        # If the input information is correct, find the user's Riot Games account, reusing the stored account
+        # if it is already registered in any server, then create the user and add them to the databse
+        account = await session.scalar(select(users.RiotAccount).where(func.lower(users.RiotAccount.username) == username.lower(),
+                                                                       func.lower(users.RiotAccount.tag) == tag.lower(),
+                                                                       users.RiotAccount.platform == platform))
+        if account is None:
+            puuID = await users.getPuuID(username, tag, platform)
+            account = await session.get(users.RiotAccount, puuID)
+            if account is None:
+                account = await users.createAccount(puuID, username, tag, platform)
+                if account.getRank(queue)[0] is None:
+                    raise Exception(f"User is not ranked in {users.queues[queue]} queue.")
+                session.add(account)
+                for ranked in users.queues:
+                    if account.getRank(ranked)[0] is not None:
+                        session.add(users.RankHistory(account, ranked))
+            elif account.platform != platform:
+                raise Exception(f"This Riot Games account is already registered on {riot.platformNames[account.platform]}")
+
+        # A stored account may not have a rank yet in the queue this server tracks
+        if account.getRank(queue)[0] is None:
+            currRanks = await users.getCurrRanks(account.summonerID, account.platform)
+            if queue not in currRanks:
+                raise Exception(f"User is not ranked in {users.queues[queue]} queue.")
+            account.updateRank(*currRanks[queue], queue)
+            session.add(users.RankHistory(account, queue))
+        newUser = users.User(discordId, serverId, account, rank, division, lp, queue)
+        session.add(newUser)
+        await session.commit()
+    leaderboards.updatePlayers([newUser])
+
+async def unregister(discId, servId):
     """
     Unregisters the user from the bot and removes them from the database
 
@@ -56,87 +120,294 @@ def unregister(discId, servId):
     """
     # Query database to see if the user is registered. If the user is registered in the server,
     # remove them from the database. If not, raise and exception
-    entries = session.query(users.User).filter_by(discordId = discId, serverId = servId).all()
-    if len(entries) == 0:
-        raise Exception("You are not registered in this server")
-    else:
-        for entry in entries:
-            session.delete(entry)
-        session.commit()
+    async with database.Session() as session:
+        entries = (await session.scalars(select(users.User).filter_by(discordId = discId, serverId = servId))).all()
+        if len(entries) == 0:
+            raise Exception("You are not registered in this server")
+        else:
+            for entry in entries:
+                # An account left in no server is no longer refreshed. Its rank is marked as never fetched so it
+                # is refreshed first if it is registered again.
+                if await session.scalar(select(func.count()).select_from(users.User).filter_by(puuID = entry.puuID)) == 1:
+                    entry.account.lastUpdated = None
+                await session.delete(entry)
+            await session.commit()
+    leaderboards.removePlayer(servId, discId)
 
-def updateRanks(server):
+async def updateRanks(server, concurrency = config.RANK_REFRESH_CONCURRENCY, deadline = config.RANK_REFRESH_DEADLINE,
+                      priority = ratelimit.REFRESH, maxAge = None):
     """
-    Iterate through all users in the server and update their current ranks by calling Riot Games API
+    Update the current ranks of all users in the server by calling Riot Games API for several players at once.
 
     Arguments:
     server - The server ID of the server to get users in and update their ranks
+    concurrency - the maximum number of Riot Games API requests in flight at the same time
+    deadline - seconds to wait before giving up on requests that have not finished
+    priority - the rate limiter priority of the refresh requests
+    maxAge - optionally ignore cached ranks older than this many seconds (0 to always call Riot Games)
+
+    Returns:
+    failed - the list of User objects whose ranks could not be updated
     """
     # Get the list of User objects for players in this server
-    players = session.query(users.User).filter_by(serverId = server).all()
-
-    # For each player in the server, call Riot Games API to get their current rank information
-    for player in players:
-        response = requests.get(f"https://na1.api.riotgames.com/lol/league/v4/entries/by-summoner/{player.summonerID}?api_key={constants.RIOT_KEY}")
-        
-        # Check that request response is valid. If not, raise an exception
-        if response.status_code != 200:
-            raise Exception("Error updating user ranks")
-        
-        # Get the response as a JSON object, then find and update their updated rank information.
-        response = response.json()
-        for entry in response:
-            if entry["queueType"] == "RANKED_SOLO_5x5":
-                player.currRank = response[0]["tier"]
-                player.currDivision = response[0]["rank"]
-                player.currLP = response[0]["leaguePoints"]
-                player.currValue = users.getRankValue(player.currRank, player.currDivision, player.currLP)
-                player.valueChange = player.currValue - player.startValue
+    start = time.time()
+    async with database.Session() as session:
+        players = (await session.scalars(select(users.User).filter_by(serverId = server))).all()
+        failed = await updatePlayers(session, players, concurrency, deadline, priority, maxAge)
 
+    # A refresh where every request failed, for example while the circuit is open, or where every account was
+    # skipped because another process is refreshing it leaves the server's ranks as old as they were
+    if any(player.account.lastUpdated is not None and player.account.lastUpdated >= start for player in players):
+        lastRefreshed[server] = start
+    lastFailed[server] = failed
+    if len(failed) > 0:
+        logger.warning("Rank refresh for server %s could not update %d players", server, len(failed))
+    return failed
 
-def getImprovementLeaderboard(server):
+async def updatePlayers(session, players, concurrency = config.RANK_REFRESH_CONCURRENCY, deadline = config.RANK_REFRESH_DEADLINE,
+                        priority = ratelimit.REFRESH, maxAge = None):
     """
-    Get the improvement leaderboard, where users are ranked by the amount of LP they have gained since registering
+    Update the current ranks of a list of users. Users sharing a Riot Games account are updated with one request.
+
+    Arguments:
+    session - the database session the users were loaded in
+    players - the list of User objects to update
+    concurrency - the maximum number of Riot Games API requests in flight at the same time
+    deadline - seconds to wait before giving up on requests that have not finished
+    priority - the rate limiter priority of the refresh requests
+    maxAge - optionally ignore cached ranks older than this many seconds (0 to always call Riot Games)
+
+    Returns:
+    failed - the list of User objects whose ranks could not be updated
+    """
+    accounts = list({player.puuID: player.account for player in players}.values())
+    failedAccounts = await updateAccounts(session, accounts, concurrency, deadline, priority, maxAge)
+    return [player for player in players if player.account in failedAccounts]
+
+async def updateAccounts(session, accounts, concurrency = config.RANK_REFRESH_CONCURRENCY, deadline = config.RANK_REFRESH_DEADLINE,
+                         priority = ratelimit.REFRESH, maxAge = None, bulkRefresh = config.BULK_REFRESH):
+    """
+    Update the current ranks of a list of Riot Games accounts and all of their server memberships. An account
+    whose request fails keeps its previous rank instead of stopping the refresh for everyone. With bulk refresh
+    the leagues the accounts were last seen in are read first, and only accounts not found there are
+    requested one at a time. Accounts that another bot process is refreshing at the same time are skipped.
+
+    Arguments:
+    session - the database session the accounts were loaded in
+    accounts - the list of RiotAccount objects to update
+    concurrency - the maximum number of Riot Games API requests in flight at the same time
+    deadline - seconds to wait before giving up on requests that have not finished
+    priority - the rate limiter priority of the refresh requests
+    maxAge - optionally ignore cached ranks older than this many seconds (0 to always call Riot Games)
+    bulkRefresh - whether to read whole leagues for divisions with many of the accounts
+
+    Returns:
+    failed - the list of RiotAccount objects whose ranks could not be updated
+    """
+    if len(accounts) == 0:
+        return []
+    semaphore = asyncio.Semaphore(concurrency)
+    history = []
+    changed = set()
+
+    # Load every server membership of the accounts up front since they cannot be loaded lazily during the refresh
+    puuIDs = [account.puuID for account in accounts]
+    await session.scalars(select(users.RiotAccount).where(users.RiotAccount.puuID.in_(puuIDs))
+                          .options(selectinload(users.RiotAccount.memberships)))
+
+    # Skip accounts another bot process is already refreshing. The claim lasts a little longer than the
+    # deadline so it only runs out early if this process stops responding.
+    claimed = await coordinator.claimAccounts(session, accounts, deadline + 10)
+    if len(claimed) < len(accounts):
+        logger.info("Skipping %d accounts being refreshed by another process", len(accounts) - len(claimed))
+    accounts = claimed
+    if len(accounts) == 0:
+        return []
+
+    # Read the Solo/Duo leagues with many of the accounts in bulk within part of the deadline, leaving the rest
+    # of it for single requests. Accounts tracked in other queues in any server need their own request for
+    # every queue anyway.
+    start = time.monotonic()
+    bulkEntries = {}
+    if bulkRefresh:
+        soloOnly = [account for account in accounts
+                    if all(membership.queue == users.SOLO for membership in account.memberships)]
+        try:
+            bulkEntries = await asyncio.wait_for(bulk.fetchRanks(soloOnly, priority), deadline * config.BULK_DEADLINE_FRACTION)
+        except asyncio.TimeoutError:
+            logger.warning("Bulk rank refresh hit its deadline")
+
+    def applyEntries(account, response):
+        # Find the updated rank of Solo/Duo and every queue tracked by the account's memberships, keeping the
+        # previous rank of a queue the account is unranked in
+        found = {entry["queueType"]: entry for entry in response}
+        for queue in {users.SOLO} | {membership.queue for membership in account.memberships}:
+            rank, division, lp = account.getRank(queue)
+            if queue in found:
+                rank, division, lp = found[queue]["tier"], found[queue]["rank"], found[queue]["leaguePoints"]
+
+            # Only add to the account's rank history when the rank has changed
+            if account.updateRank(rank, division, lp, queue):
+                history.append(users.RankHistory(account, queue))
+                changed.add(account)
+
+    async def updateAccount(account):
+        # Call Riot Games API to get the account's current rank information, limiting the number of calls at once
+        async with semaphore:
+            response = await riot.client.getLeagueEntries(account.summonerID, account.platform, priority, maxAge)
+        applyEntries(account, response)
+
+    # Update the accounts found in bulk, then refresh every other account concurrently and stop waiting
+    # once the deadline has passed
+    remaining = []
+    for account in accounts:
+        if account.summonerID in bulkEntries:
+            applyEntries(account, [bulkEntries[account.summonerID]])
+        else:
+            remaining.append(account)
+    tasks = {asyncio.create_task(updateAccount(account)): account for account in remaining}
+    done, pending = set(), set()
+    if len(tasks) > 0:
+        done, pending = await asyncio.wait(tasks, timeout = max(deadline - (time.monotonic() - start), 0.1))
+    for task in pending:
+        task.cancel()
+
+    # Keep track of the accounts that failed or timed out so their previous rank is still shown
+    failed = [tasks[task] for task in pending]
+    for task in done:
+        if task.exception() is not None:
+            logger.warning("Error updating rank for %s: %s", tasks[task].username, task.exception())
+            failed.append(tasks[task])
+
+    # Write the rank history of every changed account in one batch and release the claims
+    session.add_all(history)
+    coordinator.releaseAccounts(accounts)
+    await session.commit()
+
+    # Move the changed players on the leaderboards kept in memory
+    leaderboards.updatePlayers([membership for account in changed for membership in account.memberships])
+    return failed
+
+async def getLastUpdated(server):
+    """
+    Get the time the ranks in the server were last brought up to date: the last refresh of the whole server,
+    or the oldest rank update of its users if every user has been updated since
+
+    Arguments:
+    server - the server ID of the server
+
+    Returns:
+    lastUpdated - the Unix timestamp of the last update, or None if the server has not been updated
+    """
+    async with database.Session() as session:
+        oldest = await session.scalar(select(func.min(users.User.lastUpdated)).filter_by(serverId = server))
+    updates = [updated for updated in [oldest, lastRefreshed.get(server)] if updated is not None]
+    return max(updates) if len(updates) > 0 else None
+
+
+async def getLeaderboardSize(server):
+    """
+    Get the number of users on the server's leaderboards
+
+    Arguments:
+    server - the server ID of the server
+    """
+    return len(await leaderboards.getBoard(server, leaderboards.RANK))
+
+def formatQueue(queue):
+    """
+    Get the text marking a player who tracks a queue other than Solo/Duo, empty for Solo/Duo
+    """
+    return "" if queue == users.SOLO else f" {users.queues[queue]}"
+
+def formatMoved(moved):
+    """
+    Get the text showing how many places a player moved since the leaderboard was last shown, empty if they did not move
+    """
+    if moved > 0:
+        return f" ↑{moved}"
+    if moved < 0:
+        return f" ↓{-moved}"
+    return ""
+
+async def getImprovementLeaderboard(server, offset = 0, limit = None):
+    """
+    Get the improvement leaderboard, where users are ranked by the amount of LP they have gained since registering.
+    Only the requested part of the leaderboard is formatted.
 
     Arguments:
     server - the server ID in which the leaderboard will be displayed in.
+    offset - the number of places to skip from the top of the leaderboard
+    limit - the maximum number of places to return, or None for the rest of the leaderboard
 
     Returns:
     text - the list of strings to be displayed as the leaderboard
     """
-    # Get the list of User objects ordered by the change in LP and append their string representation
-    # to the text list (with + or - lp depending on whether they have improved or not)
+    # Get the players ordered by the change in LP and append their string representation to the text list
+    # (with + or - lp depending on whether they have improved or not, and the places they moved since the
+    # leaderboard was last shown)
     text = []
-    place = 1
-    players = session.query(users.User).filter_by(serverId = server).order_by(users.User.valueChange.desc()).all()
-    for player in players:
+    for place, player, moved in await leaderboards.getPage(server, leaderboards.IMPROVEMENT, offset, limit):
         if player.valueChange > 0:
-            text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP (+{player.valueChange} LP)")
+            text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP{formatQueue(player.queue)} (+{player.valueChange} LP){formatMoved(moved)}")
         else:
-            text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP ({player.valueChange} LP)")
-        place += 1
+            text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP{formatQueue(player.queue)} ({player.valueChange} LP){formatMoved(moved)}")
     return text
 
-def getRankLeaderboard(server):
+async def getRankLeaderboard(server, offset = 0, limit = None):
     """
-    Get the rank leaderboard, where users are ranked by their current rank
+    Get the rank leaderboard, where users are ranked by their current rank. Only the requested part of the
+    leaderboard is formatted.
     
     Arguments:
     server - the server ID in which the ranked leaderboard will be displayed
+    offset - the number of places to skip from the top of the leaderboard
+    limit - the maximum number of places to return, or None for the rest of the leaderboard
 
     Returns:
     text - the list of strings to be displayed as the leaderboard
     """
-    # Get the list of User objects ordered by their rank and append their string representation to the
-    # text list. Then return the text list
+    # Get the players ordered by their rank and append their string representation to the text list.
+    # Then return the text list
     text = []
-    place = 1
-    players = session.query(users.User).filter_by(serverId = server).order_by(users.User.currValue.desc()).all()
-    for player in players:
-        text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP")
-        place += 1
+    for place, player, moved in await leaderboards.getPage(server, leaderboards.RANK, offset, limit):
+        text.append(f"**{place}. {player.username}** {player.currRank} {player.currDivision} {player.currLP} LP{formatQueue(player.queue)}{formatMoved(moved)}")
     return text
 
-def displayInfo(user, server):
+# Title of each leaderboard and the function that gets its text
+boardTitles = {leaderboards.IMPROVEMENT: "Rank Improvement Leaderboard", leaderboards.RANK: "Rank Leaderboard"}
+boardText = {leaderboards.IMPROVEMENT: getImprovementLeaderboard, leaderboards.RANK: getRankLeaderboard}
+
+async def getLeaderboardEmbed(server, column, page, elementsPerPage):
+    """
+    Get the embed for one page of a server's leaderboard. Rendered pages are kept with the leaderboard and reused
+    until a player on it changes, so the places moved shown on a page are the ones from the last change.
+
+    Arguments:
+    server - the server ID of the server
+    column - the leaderboard to display (leaderboards.IMPROVEMENT or leaderboards.RANK)
+    page - the number of the page, starting at 1
+    elementsPerPage - the number of players on each page
+
+    Returns:
+    embed - the embed of the page, which must be copied before changing it
+    """
+    board = await leaderboards.getBoard(server, column)
+    if (page, elementsPerPage) in board.rendered:
+        metrics.increment("leaderboard_page_cache_total", {"result": "hit"})
+        return board.rendered[(page, elementsPerPage)]
+    metrics.increment("leaderboard_page_cache_total", {"result": "miss"})
+
+    # Create the embed to display the leaderboard
+    text = await boardText[column](server, (page - 1) * elementsPerPage, elementsPerPage)
+    embed = discord.Embed(title = boardTitles[column],
+                          description = "".join(f"{line}\n" for line in text),
+                          color = discord.Color.from_str("#101539"))
+    embed.set_thumbnail(url = "https://i.imgur.com/0QKRQ5V.png")
+    board.rendered[(page, elementsPerPage)] = embed
+    return embed
+
+async def displayInfo(user, server):
     """
     Get the user's information (rank, wins, losses, winrate, most played champions, and profile picture) and
     create an embed for display and return the embed.
@@ -145,62 +416,132 @@ def displayInfo(user, server):
     user - the user's discord ID of who to get the information of
 
     Returns:
-    embed - the embed to be displayed in discord
-    file - the piechart image file to be displayed in the embed
+    embeds - the embeds to be displayed in discord
+    files - the piechart and rank history image files to be displayed in the embeds
     """
 
     # Parse the discord ID and use it to query the database for the player's User object
     discID = int(re.search(r"[0-9]+", user).group())
-    player = session.query(users.User).filter_by(discordId = discID, serverId = server).first()
+    async with database.Session() as session:
+        player = await session.get(users.User, (discID, server))
     if player is None:
         raise Exception("User not registered in this server.")
 
-    # Call the Riot Games APIs to get ranked information and account information. If either return
-    # an unsuccessful response code, raise an exception. Then convert response and icon data to needed types.
-    response = requests.get(f"https://na1.api.riotgames.com/lol/league/v4/entries/by-summoner/{player.summonerID}?api_key={constants.RIOT_KEY}")
-    icon = requests.get(f"https://na1.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{player.puuID}?api_key={constants.RIOT_KEY}")
-    if response.status_code != 200 or icon.status_code != 200:
-        raise Exception("Error getting user information from Riot Games API")
-    
-    response = response.json()
-    icon = icon.json()["profileIconId"]
-
-    # Loop through the data in response and find the information associated with ranked Solo/Duo
-    for entry in response:
-        if entry["queueType"] == "RANKED_SOLO_5x5":
-            # Get win and loss information
-            wins = entry["wins"]
-            losses = entry["losses"]
-
-            # Setup a pie chart to display winrate using matplotlib
-            data = [wins, losses]
-            colors = ["#3469d1", "#d13434"]
-
-            fig1, ax = plt.subplots()
-            ax.pie(data, colors = colors, startangle = 90)
-
-            center_circle = plt.Circle((0, 0), 0.8, fc = "#2b2d31")
-            fig = plt.gcf()
-            fig.gca().add_artist(center_circle)
-
-            ax.text(0, 0, (format(wins/(wins + losses), ".0%")), ha = "center", va = "center", color = "white", fontsize = 16)
-            ax.axis("equal")
-            fig.patch.set_facecolor("#2b2d31")
-            fig.set_size_inches(1.5, 1.5)
-            plt.tight_layout()
-            plt.savefig("wr.png")
-
-            # Get the user's top 3 most played champions
-            championList = champions.getBestChampions(player.puuID)
-
-            # Create the embed to be displayed in discord as a response to the command
-            embed = discord.Embed(title = f"{player.username}",
-                                  description = f"{player.currRank} {player.currDivision} {player.currLP} LP\nWins: {wins}" +
-                                   f" | Losses: {losses}\n\n**Most Played Champions:**\n" +
-                                   f"1. {championList[0]}\n2. {championList[1]}\n3. {championList[2]}",
-                                  color = discord.Color.from_str("#101539"))
-            embed.set_thumbnail(url = f"https://ddragon.leagueoflegends.com/cdn/14.2.1/img/profileicon/{icon}.png")
-            file = discord.File("./wr.png", filename = "wr.png")
-            embed.set_image(url = "attachment://wr.png")
-
-            return embed, file
\ No newline at end of file
+    # Start every independent step at once so the command takes as long as the slowest step rather than
+    # the sum of all of them. The winrate chart is rendered as soon as the ranked information arrives.
+    timings = {}
+    async def timed(stage, coroutine):
+        stageStart = time.monotonic()
+        try:
+            return await coroutine
+        finally:
+            timings[stage] = time.monotonic() - stageStart
+
+    async def getRankedEntry():
+        # Find the information associated with the queue tracked in this server
+        try:
+            response = await timed("league", riot.client.getLeagueEntries(player.summonerID, player.platform))
+        except riot.RiotAPIError as e:
+            raise users.getRiotError(e, "Error getting user information from Riot Games API")
+        for entry in response:
+            if entry["queueType"] == player.queue:
+                return entry, await timed("winrateChart", charts.getWinrateChart(entry["wins"], entry["losses"]))
+        raise Exception(f"User is not ranked in {users.queues[player.queue]} queue.")
+
+    async def getIcon():
+        try:
+            summoner = await timed("summoner", riot.client.getSummonerByPuuID(player.puuID, player.platform))
+        except riot.RiotAPIError as e:
+            raise users.getRiotError(e, "Error getting user information from Riot Games API")
+        return summoner["profileIconId"]
+
+    async def getHistoryChart():
+        # Get a graph of the user's rank over the last 30 days if it has changed
+        rankHistory = await timed("history", history.getHistory(player.puuID, queue = player.queue))
+        if len(rankHistory) > 1:
+            return await timed("historyChart", charts.getHistoryChart(player.puuID, rankHistory))
+        return None
+
+    start = time.monotonic()
+    tasks = [asyncio.create_task(getRankedEntry()),
+             asyncio.create_task(getIcon()),
+             asyncio.create_task(timed("masteries", champions.getBestChampions(player.puuID, player.platform))),
+             asyncio.create_task(timed("weeklyGain", history.getRecentGain(player.puuID, player.currValue, queue = player.queue))),
+             asyncio.create_task(getHistoryChart()),
+             asyncio.create_task(timed("place", leaderboards.getPlace(server, leaderboards.RANK, discID)))]
+    # Let every step finish even if one fails, since cancelling a step in the middle of a database query
+    # would leave its connection in an unknown state
+    results = await asyncio.gather(*tasks, return_exceptions = True)
+    logger.info("/info for %s took %.3fs (%s)", player.username, time.monotonic() - start,
+                ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items()))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    (entry, chart), icon, championList, gain, historyChart, (place, total) = results
+
+    # Create the embed to be displayed in discord as a response to the command
+    wins, losses = entry["wins"], entry["losses"]
+    embed = discord.Embed(title = f"{player.username}",
+                          description = f"{player.currRank} {player.currDivision} {player.currLP} LP\n" +
+                           f"Server rank: #{place} of {total}\nWins: {wins}" +
+                           f" | Losses: {losses}\nLast 7 days: {gain:+} LP\n\n**Most Played Champions:**\n" +
+                           f"1. {championList[0]}\n2. {championList[1]}\n3. {championList[2]}",
+                          color = discord.Color.from_str("#101539"))
+    embed.set_thumbnail(url = f"https://ddragon.leagueoflegends.com/cdn/{champions.getVersion()}/img/profileicon/{icon}.png")
+    embed.set_image(url = "attachment://wr.png")
+    embeds, files = [embed], [discord.File(io.BytesIO(chart), filename = "wr.png")]
+
+    if historyChart is not None:
+        historyEmbed = discord.Embed(title = "Rank History (30 days)", color = discord.Color.from_str("#101539"))
+        historyEmbed.set_image(url = "attachment://history.png")
+        embeds.append(historyEmbed)
+        files.append(discord.File(io.BytesIO(historyChart), filename = "history.png"))
+
+    return embeds, files
+
+def displayStats():
+    """
+    Create an embed with the bot's performance metrics: event loop lag, command latency, Riot Games API
+    latency and rate limit budget, database query latency and cache hit rates
+
+    Returns:
+    embed - the embed to be displayed in discord
+    """
+    def formatSummary(count, average):
+        return f"{count} × {average * 1000:.0f}ms avg"
+
+    def formatCache(stats):
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        hitRate = (stats["hits"] + stats["coalesced"]) / lookups if lookups > 0 else 0
+        return f"{hitRate:.0%} hit rate ({lookups} lookups, {stats['size']} entries)"
+
+    embed = discord.Embed(title = "Bot Stats", color = discord.Color.from_str("#101539"))
+
+    # Event loop lag, the time other work kept the bot from responding
+    lag = metrics.getSummaries("event_loop_lag_seconds").get(None, (0, 0))[1]
+    embed.add_field(name = "Event Loop Lag", value = f"{lag * 1000:.1f}ms avg", inline = False)
+
+    # Latency of each slash command
+    commandSummaries = metrics.getSummaries("command_seconds", "command")
+    embed.add_field(name = "Commands", value = "\n".join(f"/{command}: {formatSummary(*summary)}"
+                                                         for command, summary in sorted(commandSummaries.items())) or "None yet",
+                    inline = False)
+
+    # Latency of each Riot Games API endpoint and the rate limit budget in use
+    riotSummaries = metrics.getSummaries("riot_request_seconds", "endpoint")
+    riotText = "\n".join(f"{endpoint}: {formatSummary(*summary)}" for endpoint, summary in sorted(riotSummaries.items()))
+    for routing, limiter in sorted(riot.client.limiters.items()):
+        usage = limiter.getUsage()
+        riotText += f"\n**{routing}** Retries: {usage['retries']} | Throttled: {usage['throttled']} | Waiting: {usage['waiting']}"
+        riotText += f" | Circuit: {riot.client.getBreaker(routing).getState()}\n"
+        riotText += "\n".join(f"{window['method']} {window['window']}s: {window['used']}/{window['limit']}"
+                              for window in usage["windows"])
+    embed.add_field(name = "Riot Games API", value = riotText.strip()[:1024] or "None yet", inline = False)
+
+    # Database query latency and cache effectiveness
+    queryText = "\n".join(f"{operation}: {formatSummary(*summary)}"
+                          for operation, summary in sorted(metrics.getSummaries("db_query_seconds", "operation").items()))
+    embed.add_field(name = "Database", value = queryText or "None yet", inline = False)
+    embed.add_field(name = "Caches", value = f"League entries: {formatCache(riot.client.leagueCache.getStats())}\n" +
+                    f"Charts: {formatCache(charts.chartCache.getStats())}", inline = False)
+    return embed
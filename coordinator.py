@@ -0,0 +1,55 @@
+from sqlalchemy import select, update
+import os
+import socket
+import time
+import uuid
+import users
+
+# Identifies this bot process in the refresh claims. Several processes can run different shards of the bot
+# against one database, and an account registered in servers on different shards should only be fetched
+# from Riot Games by one of them at a time.
+processId = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def isClaimable(now):
+    """
+    Get the condition for accounts that no other process is refreshing right now
+    """
+    return ((users.RiotAccount.refreshClaim == None) | (users.RiotAccount.refreshClaimedUntil < now) |
+            (users.RiotAccount.refreshClaim == processId))
+
+async def claimAccounts(session, accounts, lease):
+    """
+    Claim the accounts for this process so other processes skip them until the claim is released or expires.
+    Accounts already claimed by this process can be claimed again, since concurrent requests for the same
+    account within one process are already shared through the league entry cache.
+
+    Arguments:
+    session - the database session the accounts were loaded in
+    accounts - the list of RiotAccount objects to claim
+    lease - the number of seconds until the claim expires if it is never released
+
+    Returns:
+    claimed - the list of RiotAccount objects this process claimed
+    """
+    now = time.time()
+    puuIDs = [account.puuID for account in accounts]
+    await session.execute(update(users.RiotAccount).where(users.RiotAccount.puuID.in_(puuIDs), isClaimable(now))
+                          .values(refreshClaim = processId, refreshClaimedUntil = now + lease)
+                          .execution_options(synchronize_session = "fetch"))
+
+    # Commit straight away so other processes see the claim and the database is not locked during the refresh
+    await session.commit()
+    claimed = set((await session.scalars(select(users.RiotAccount.puuID).where(users.RiotAccount.puuID.in_(puuIDs),
+                                                                                users.RiotAccount.refreshClaim == processId))).all())
+    return [account for account in accounts if account.puuID in claimed]
+
+def releaseAccounts(accounts):
+    """
+    Release the claim on the accounts, written with the next commit of their session
+
+    Arguments:
+    accounts - the list of RiotAccount objects claimed by this process
+    """
+    for account in accounts:
+        account.refreshClaim = None
+        account.refreshClaimedUntil = None
@@ -0,0 +1,54 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+import time
+import config
+import metrics
+import migrations
+
+def createEngine(url):
+    """
+    Create the async database engine, using WAL mode for SQLite so reads are not blocked by writes
+
+    Arguments:
+    url - the SQLAlchemy URL of the database
+    """
+    if url.startswith("sqlite"):
+        engine = create_async_engine(url, echo = False)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def setPragmas(connection, record):
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+    else:
+        engine = create_async_engine(url, echo = False, pool_size = config.DATABASE_POOL_SIZE, pool_pre_ping = True)
+
+    # Time every query, labelled with its kind (SELECT, INSERT, UPDATE, ...)
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def startQuery(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("queryStart", []).append(time.monotonic())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def finishQuery(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.monotonic() - connection.info["queryStart"].pop()
+        metrics.observe("db_query_seconds", seconds, {"operation": statement.lstrip().split(" ", 1)[0].upper()})
+    return engine
+
+# Engine and session factory for storing and accessing user information. Each command or background
+# task opens its own session with "async with database.Session() as session:"
+engine = createEngine(config.DATABASE_URL)
+Session = async_sessionmaker(engine, expire_on_commit = False)
+
+async def init():
+    """
+    Create the database tables and migrate existing databases to the latest schema, called once when the bot starts
+    """
+    async with engine.begin() as connection:
+        await connection.run_sync(migrations.upgrade)
+
+async def close():
+    """
+    Close every pooled database connection
+    """
+    await engine.dispose()
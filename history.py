@@ -0,0 +1,133 @@
+import time
+from sqlalchemy import Integer, cast, delete, func, select
+import config
+import database
+import users
+
+DAY = 86400
+
+async def compact(session, fullDays = config.HISTORY_FULL_DAYS):
+    """
+    Downsample the rank history so it stays small: entries from the last fullDays days are all kept,
+    older entries are reduced to the last entry of each day for each account and queue
+
+    Arguments:
+    session - the database session to make the changes in
+    fullDays - the number of days every entry is kept for
+
+    Returns:
+    deleted - the number of entries removed
+    """
+    cutoff = time.time() - fullDays * DAY
+    day = cast(users.RankHistory.timestamp, Integer) // DAY
+    lastOfDay = select(func.max(users.RankHistory.id)).where(users.RankHistory.timestamp < cutoff) \
+                .group_by(users.RankHistory.puuID, users.RankHistory.queue, day)
+    result = await session.execute(delete(users.RankHistory).where(users.RankHistory.timestamp < cutoff,
+                                                                   users.RankHistory.id.notin_(lastOfDay)))
+    await session.commit()
+    return result.rowcount
+
+async def getValuesAt(session, puuIDs, timestamp, queue = users.SOLO):
+    """
+    Get the rank value each account had in a queue at a point in time. Accounts whose history starts after
+    that time use their first recorded value.
+
+    Arguments:
+    session - the database session to read from
+    puuIDs - the puuIDs of the accounts
+    timestamp - the Unix timestamp to get the values at
+    queue - the ranked queue to get the values of
+
+    Returns:
+    values - a dictionary of puuID to rank value for the accounts that have any history
+    """
+    values = {}
+
+    # Latest entry at or before the timestamp for each account
+    latest = select(users.RankHistory.puuID, func.max(users.RankHistory.timestamp).label("timestamp")) \
+             .where(users.RankHistory.puuID.in_(puuIDs), users.RankHistory.queue == queue,
+                    users.RankHistory.timestamp <= timestamp) \
+             .group_by(users.RankHistory.puuID).subquery()
+    rows = await session.execute(select(users.RankHistory.puuID, users.RankHistory.value)
+                                 .where(users.RankHistory.queue == queue)
+                                 .join(latest, (users.RankHistory.puuID == latest.c.puuID) &
+                                               (users.RankHistory.timestamp == latest.c.timestamp)))
+    for puuID, value in rows:
+        values[puuID] = value
+
+    # First entry for accounts that have no history before the timestamp
+    missing = [puuID for puuID in puuIDs if puuID not in values]
+    if len(missing) > 0:
+        earliest = select(users.RankHistory.puuID, func.min(users.RankHistory.timestamp).label("timestamp")) \
+                   .where(users.RankHistory.puuID.in_(missing), users.RankHistory.queue == queue) \
+                   .group_by(users.RankHistory.puuID).subquery()
+        rows = await session.execute(select(users.RankHistory.puuID, users.RankHistory.value)
+                                     .where(users.RankHistory.queue == queue)
+                                     .join(earliest, (users.RankHistory.puuID == earliest.c.puuID) &
+                                                     (users.RankHistory.timestamp == earliest.c.timestamp)))
+        for puuID, value in rows:
+            values[puuID] = value
+    return values
+
+async def getRecentGain(puuID, currValue, days = 7, queue = users.SOLO):
+    """
+    Get the LP an account has gained in a queue over the last number of days
+
+    Arguments:
+    puuID - the puuID of the account
+    currValue - the account's current rank value in the queue
+    days - the number of days to look back
+    queue - the ranked queue
+
+    Returns:
+    gain - the change in rank value, or 0 if the account has no history
+    """
+    async with database.Session() as session:
+        values = await getValuesAt(session, [puuID], time.time() - days * DAY, queue)
+    return currValue - values.get(puuID, currValue)
+
+async def getClimberOfTheWeek(server, days = 7):
+    """
+    Get the user in the server who gained the most LP over the last number of days
+
+    Arguments:
+    server - the server ID of the server
+    days - the number of days to look back
+
+    Returns:
+    player, gain - the User object of the top climber and the LP they gained, or (None, 0) if nobody gained LP
+    """
+    async with database.Session() as session:
+        players = (await session.scalars(select(users.User).filter_by(serverId = server))).all()
+
+        # Each player is compared to their history in the queue they track
+        values = {}
+        for queue in set(player.queue for player in players):
+            queueValues = await getValuesAt(session, [player.puuID for player in players if player.queue == queue],
+                                            time.time() - days * DAY, queue)
+            values.update({(puuID, queue): value for puuID, value in queueValues.items()})
+    best, bestGain = None, 0
+    for player in players:
+        gain = player.currValue - values.get((player.puuID, player.queue), player.currValue)
+        if gain > bestGain:
+            best, bestGain = player, gain
+    return best, bestGain
+
+async def getHistory(puuID, days = 30, queue = users.SOLO):
+    """
+    Get the rank history of an account in a queue for the last number of days
+
+    Arguments:
+    puuID - the puuID of the account
+    days - the number of days of history to get
+    queue - the ranked queue
+
+    Returns:
+    history - a list of (timestamp, value) pairs ordered from oldest to newest
+    """
+    async with database.Session() as session:
+        rows = await session.execute(select(users.RankHistory.timestamp, users.RankHistory.value)
+                                     .where(users.RankHistory.puuID == puuID, users.RankHistory.queue == queue,
+                                            users.RankHistory.timestamp >= time.time() - days * DAY)
+                                     .order_by(users.RankHistory.timestamp))
+        return [(timestamp, value) for timestamp, value in rows]
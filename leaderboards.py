@@ -0,0 +1,182 @@
+from sqlalchemy import select
+from bisect import bisect_left, insort
+from collections import namedtuple
+import cache
+import config
+import database
+import users
+
+# Leaderboards of each server and the column players are ordered by
+IMPROVEMENT = "valueChange"
+RANK = "currValue"
+
+# Copy of the columns of a player shown on the leaderboards. A copy is kept rather than the User object so the
+# entry keeps its place in the sorted keys until the leaderboard is told the player changed.
+fields = ["discordId", "username", "queue", "currRank", "currDivision", "currLP", "currValue", "valueChange"]
+Entry = namedtuple("Entry", fields)
+
+class Leaderboard:
+    def __init__(self, column: str):
+        """
+        One server leaderboard kept in memory as a sorted list of (-value, discord ID) keys, so finding a
+        player's place is a binary search and a rank change moves a single player instead of sorting everyone.
+        Ties are ordered by discord ID like the database queries.
+
+        Arguments:
+        column - the User column the leaderboard is ordered by (IMPROVEMENT or RANK)
+        """
+        self.column = column
+        self.keys = []
+        self.entries = {}
+
+        # Pages already rendered for display, cleared whenever a player is added, moved or removed
+        self.rendered = {}
+
+    def getKey(self, entry):
+        return -getattr(entry, self.column), entry.discordId
+
+    def add(self, player):
+        """
+        Add a player to the leaderboard, moving them if they are already on it
+
+        Arguments:
+        player - the player's User object or a row with the same columns
+        """
+        entry = Entry(*[getattr(player, field) for field in fields])
+        self.remove(player.discordId)
+        self.entries[player.discordId] = entry
+        insort(self.keys, self.getKey(entry))
+        self.rendered.clear()
+
+    def remove(self, discordId):
+        """
+        Remove a player from the leaderboard if they are on it
+
+        Arguments:
+        discordId - the player's discord ID
+        """
+        entry = self.entries.pop(discordId, None)
+        if entry is not None:
+            del self.keys[bisect_left(self.keys, self.getKey(entry))]
+            self.rendered.clear()
+
+    def getPlace(self, discordId):
+        """
+        Get a player's place on the leaderboard, starting at 1, or None if they are not on it
+
+        Arguments:
+        discordId - the player's discord ID
+        """
+        entry = self.entries.get(discordId)
+        if entry is None:
+            return None
+        return bisect_left(self.keys, self.getKey(entry)) + 1
+
+    def getPage(self, offset: int, limit: int = None):
+        """
+        Get part of the leaderboard
+
+        Arguments:
+        offset - the number of places to skip from the top of the leaderboard
+        limit - the maximum number of places to return, or None for the rest of the leaderboard
+
+        Returns:
+        entries - a list of (place, Entry) pairs
+        """
+        keys = self.keys[offset:] if limit is None else self.keys[offset:offset + limit]
+        return [(offset + i + 1, self.entries[discordId]) for i, (_, discordId) in enumerate(keys)]
+
+    def __len__(self):
+        return len(self.keys)
+
+# Loaded leaderboards keyed by (server ID, column). Changes made by this process are applied as they happen;
+# boards are reloaded after LEADERBOARD_MAX_AGE seconds to pick up changes made by other bot processes.
+boards = cache.TTLCache(config.LEADERBOARD_MAX_AGE, config.LEADERBOARD_CACHE_SIZE)
+
+# Place of each player the last time they were shown on a leaderboard, keyed by (server ID, column)
+lastViewed = cache.TTLCache(float("inf"), config.LEADERBOARD_CACHE_SIZE)
+
+async def getBoard(server, column):
+    """
+    Get a server's leaderboard, loading it from the database if it is not loaded
+
+    Arguments:
+    server - the server ID of the server
+    column - the column the leaderboard is ordered by (IMPROVEMENT or RANK)
+    """
+    async def load():
+        board = Leaderboard(column)
+        async with database.Session() as session:
+            rows = (await session.execute(select(*[getattr(users.User, field) for field in fields])
+                                          .filter_by(serverId = server))).all()
+        for row in rows:
+            board.entries[row.discordId] = Entry(*row)
+        board.keys = sorted(board.getKey(entry) for entry in board.entries.values())
+        return board
+    return await boards.getOrFetch((server, column), load)
+
+def updatePlayers(players):
+    """
+    Move players whose rank changed on every loaded leaderboard of their server
+
+    Arguments:
+    players - the list of User objects that changed or were registered
+    """
+    for player in players:
+        for column in [IMPROVEMENT, RANK]:
+            board = boards.get((player.serverId, column))
+            if board is not None:
+                board.add(player)
+
+def removePlayer(server, discordId):
+    """
+    Remove an unregistered player from the loaded leaderboards of a server
+
+    Arguments:
+    server - the server ID of the server
+    discordId - the player's discord ID
+    """
+    for column in [IMPROVEMENT, RANK]:
+        board = boards.get((server, column))
+        if board is not None:
+            board.remove(discordId)
+
+async def getPage(server, column, offset = 0, limit = None):
+    """
+    Get part of a server's leaderboard along with how many places each player moved since they were last shown
+
+    Arguments:
+    server - the server ID of the server
+    column - the column the leaderboard is ordered by (IMPROVEMENT or RANK)
+    offset - the number of places to skip from the top of the leaderboard
+    limit - the maximum number of places to return, or None for the rest of the leaderboard
+
+    Returns:
+    entries - a list of (place, entry, moved) tuples where moved is the number of places gained since the
+    player was last shown (negative if they dropped)
+    """
+    board = await getBoard(server, column)
+    viewed = lastViewed.get((server, column))
+    if viewed is None:
+        viewed = {}
+        lastViewed.set((server, column), viewed)
+    entries = []
+    for place, entry in board.getPage(offset, limit):
+        entries.append((place, entry, viewed.get(entry.discordId, place) - place))
+        viewed[entry.discordId] = place
+    return entries
+
+async def getPlace(server, column, discordId):
+    """
+    Get a player's place on a server's leaderboard
+
+    Arguments:
+    server - the server ID of the server
+    column - the column the leaderboard is ordered by (IMPROVEMENT or RANK)
+    discordId - the player's discord ID
+
+    Returns:
+    place, total - the player's place (None if they are not registered) and the number of players
+    """
+    board = await getBoard(server, column)
+    return board.getPlace(discordId), len(board)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from aiohttp import web
+import config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets used for every timing
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Recorded metrics keyed by (name, labels) where labels is a sorted tuple of (label, value) pairs. Every change
+# is made while holding the lock so metrics can also be recorded from other threads.
+lock = threading.Lock()
+counters = {}
+histograms = {}
+gauges = {}
+
+# Functions called when the metrics are read, each returning a list of (name, labels, value) gauges
+collectors = []
+
+# Descriptions shown in the metrics endpoint
+descriptions = {
+    "command_seconds": "Time from a slash command being used to the bot finishing its response",
+    "command_errors_total": "Slash commands that responded with an error",
+    "riot_request_seconds": "Latency of Riot Games API requests",
+    "riot_rate_limit_wait_seconds": "Time Riot Games API requests waited for the rate limiter",
+    "riot_retries_total": "Riot Games API requests retried after a 429 or 5xx response",
+    "riot_circuit_open": "Whether requests to a Riot Games platform or region are being refused after repeated failures",
+    "db_query_seconds": "Latency of database queries",
+    "chart_render_seconds": "Time spent rendering charts",
+    "event_loop_lag_seconds": "How late the event loop woke up a task that asked to sleep",
+    "startup_seconds": "Time each stage of the last startup took",
+    "leaderboard_page_cache_total": "Leaderboard pages shown from the rendered page cache (hit) or rendered (miss)",
+}
+
+def getKey(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in (labels or {}).items()))
+
+def increment(name, labels = None, value = 1):
+    """
+    Add to a counter
+
+    Arguments:
+    name - the name of the counter
+    labels - optional dictionary of label names to values
+    value - the amount to add
+    """
+    key = getKey(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, value, labels = None):
+    """
+    Record a value, usually a number of seconds, in a histogram
+
+    Arguments:
+    name - the name of the histogram
+    value - the value to record
+    labels - optional dictionary of label names to values
+    """
+    key = getKey(name, labels)
+    with lock:
+        if key not in histograms:
+            histograms[key] = {"buckets": [0] * len(buckets), "count": 0, "sum": 0}
+        histogram = histograms[key]
+        histogram["count"] += 1
+        histogram["sum"] += value
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+
+def setGauge(name, value, labels = None):
+    """
+    Set a gauge to its current value
+
+    Arguments:
+    name - the name of the gauge
+    value - the current value
+    labels - optional dictionary of label names to values
+    """
+    with lock:
+        gauges[getKey(name, labels)] = value
+
+@contextmanager
+def span(name, **labels):
+    """
+    Time the code inside a with block and record it in the {name}_seconds histogram, labelled with whether
+    the block raised an exception. Spans are also logged at debug level.
+
+    Arguments:
+    name - the name of the span
+    labels - labels to record the timing with
+    """
+    start = time.monotonic()
+    status = "ok"
+    try:
+        yield labels
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.monotonic() - start
+        observe(f"{name}_seconds", seconds, {**labels, "status": labels.get("status", status)})
+        logger.debug("span=%s seconds=%.4f status=%s %s", name, seconds, labels.get("status", status),
+                     " ".join(f"{label}={value}" for label, value in labels.items() if label != "status"))
+
+def addCollector(collector):
+    """
+    Register a function that returns current gauge values whenever the metrics are read
+
+    Arguments:
+    collector - function returning a list of (name, labels, value) tuples
+    """
+    collectors.append(collector)
+
+def collect():
+    """
+    Get a snapshot of every metric, including the gauges from the collectors
+
+    Returns:
+    counters, histograms, gauges - copies of the recorded metrics
+    """
+    with lock:
+        snapshot = dict(counters), {key: {**value, "buckets": list(value["buckets"])} for key, value in histograms.items()}, dict(gauges)
+    for collector in collectors:
+        try:
+            for name, labels, value in collector():
+                snapshot[2][getKey(name, labels)] = value
+        except Exception:
+            logger.exception("Metrics collector failed")
+    return snapshot
+
+def getSummaries(name, groupBy = None):
+    """
+    Get the number of values recorded in a histogram and their average, adding together every series
+    with the same value of the groupBy label
+
+    Arguments:
+    name - the name of the histogram
+    groupBy - optional label to group the series by, or None to add together every series
+
+    Returns:
+    summaries - dictionary of label value (None without groupBy) to a (count, average) pair
+    """
+    _, recorded, _ = collect()
+    totals = {}
+    for (histogramName, labels), histogram in recorded.items():
+        if histogramName == name:
+            group = dict(labels).get(groupBy) if groupBy is not None else None
+            count, total = totals.get(group, (0, 0))
+            totals[group] = (count + histogram["count"], total + histogram["sum"])
+    return {group: (count, total / count if count > 0 else 0) for group, (count, total) in totals.items()}
+
+def formatLabels(labels, extra = ()):
+    labels = list(labels) + list(extra)
+    if len(labels) == 0:
+        return ""
+    escaped = [(label, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for label, value in labels]
+    return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+def render():
+    """
+    Get every metric in the Prometheus text format
+    """
+    recordedCounters, recordedHistograms, recordedGauges = collect()
+    lines = []
+    for kind, recorded in (("counter", recordedCounters), ("histogram", recordedHistograms), ("gauge", recordedGauges)):
+        for metricName in sorted({name for name, _ in recorded}):
+            if metricName in descriptions:
+                lines.append(f"# HELP {metricName} {descriptions[metricName]}")
+            lines.append(f"# TYPE {metricName} {kind}")
+            for (name, labels), value in sorted(recorded.items(), key = lambda item: item[0]):
+                if name != metricName:
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{name}{formatLabels(labels)} {value}")
+                    continue
+                for bound, count in zip(buckets, value["buckets"]):
+                    lines.append(f"{name}_bucket{formatLabels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{formatLabels(labels, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{formatLabels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{formatLabels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+async def monitorLoopLag(interval = config.LOOP_LAG_INTERVAL):
+    """
+    Measure how late the event loop wakes up a sleeping task, which shows how long other work is blocking it.
+    Runs until cancelled.
+
+    Arguments:
+    interval - seconds between measurements
+    """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(time.monotonic() - start - interval, 0)
+        observe("event_loop_lag_seconds", lag)
+        setGauge("event_loop_lag_last_seconds", lag)
+
+async def startServer(host = config.METRICS_HOST, port = config.METRICS_PORT):
+    """
+    Serve the metrics over HTTP at /metrics
+
+    Arguments:
+    host - the address to listen on
+    port - the port to listen on
+
+    Returns:
+    runner - the server's runner, cleaned up to stop the server
+    """
+    async def handle(request):
+        return web.Response(text = render(), content_type = "text/plain", charset = "utf-8")
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,122 @@
+from sqlalchemy import inspect, text
+import users
+
+# Each migration brings the database schema from one version to the next. Migrations are run in order
+# on databases created by an older version of the bot. Add new migrations to the end of the list and
+# never reorder or remove them, since the schema version stored in the database is an index into it.
+
+def addLastUpdated(connection):
+    """
+    Add the lastUpdated column to the users table
+    """
+    if "lastUpdated" not in [column["name"] for column in inspect(connection).get_columns("users")]:
+        connection.execute(text('ALTER TABLE users ADD COLUMN "lastUpdated" FLOAT'))
+
+def createRiotAccounts(connection):
+    """
+    Create the shared Riot Games account rows for users registered before accounts were stored separately
+    """
+    # Plain SQL is used rather than the models since the models describe the latest schema, which may have
+    # columns that do not exist yet at this point of the migration
+    rows = connection.execute(text('SELECT "puuID", username, tag, "summonerID", "accountID", "currRank", "currDivision", '
+                                   '"currLP", "currValue", "lastUpdated" FROM users '
+                                   'WHERE "puuID" NOT IN (SELECT "puuID" FROM "riotAccounts")')).mappings().all()
+    created = set()
+    for row in rows:
+        if row["puuID"] not in created:
+            connection.execute(text('INSERT INTO "riotAccounts" ("puuID", username, tag, "summonerID", "accountID", "currRank", '
+                                    '"currDivision", "currLP", "currValue", "lastUpdated") VALUES (:puuID, :username, :tag, '
+                                    ':summonerID, :accountID, :currRank, :currDivision, :currLP, :currValue, :lastUpdated)'), dict(row))
+            created.add(row["puuID"])
+
+def addLeaderboardIndexes(connection):
+    """
+    Add the indexes used to read leaderboards, memberships and stale accounts
+    """
+    for table in [users.User.__table__, users.RiotAccount.__table__]:
+        for index in table.indexes:
+            if index.name in ["ix_users_serverId_valueChange", "ix_users_serverId_currValue",
+                              "ix_users_puuID", "ix_riotAccounts_lastUpdated"]:
+                index.create(connection, checkfirst = True)
+
+def seedRankHistory(connection):
+    """
+    Start the rank history of every existing account with its current rank
+    """
+    connection.execute(text('INSERT INTO "rankHistory" ("puuID", timestamp, rank, division, lp, value) '
+                            'SELECT "puuID", COALESCE("lastUpdated", 0), "currRank", "currDivision", "currLP", "currValue" '
+                            'FROM "riotAccounts" WHERE "puuID" NOT IN (SELECT "puuID" FROM "rankHistory")'))
+
+def addRefreshClaims(connection):
+    """
+    Add the columns used to coordinate rank refreshes between bot processes to the riotAccounts table
+    """
+    columns = [column["name"] for column in inspect(connection).get_columns("riotAccounts")]
+    if "refreshClaim" not in columns:
+        connection.execute(text('ALTER TABLE "riotAccounts" ADD COLUMN "refreshClaim" VARCHAR'))
+    if "refreshClaimedUntil" not in columns:
+        connection.execute(text('ALTER TABLE "riotAccounts" ADD COLUMN "refreshClaimedUntil" FLOAT'))
+
+def addRegionsAndQueues(connection):
+    """
+    Add the platform and Flex rank columns to riotAccounts, the platform and queue columns to users and the queue
+    column to rankHistory. Existing rows are from before other platforms and queues were supported, so they are
+    on na1 and track Solo/Duo.
+    """
+    added = {"riotAccounts": [("platform", "VARCHAR NOT NULL DEFAULT 'na1'"), ("flexRank", "VARCHAR"),
+                              ("flexDivision", "VARCHAR"), ("flexLP", "INTEGER"), ("flexValue", "INTEGER")],
+             "users": [("platform", "VARCHAR NOT NULL DEFAULT 'na1'"), ("queue", "VARCHAR NOT NULL DEFAULT 'RANKED_SOLO_5x5'")],
+             "rankHistory": [("queue", "VARCHAR NOT NULL DEFAULT 'RANKED_SOLO_5x5'")]}
+    for table, columns in added.items():
+        existing = [column["name"] for column in inspect(connection).get_columns(table)]
+        for column, definition in columns:
+            if column not in existing:
+                connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'))
+
+def widenDiscordIds(connection):
+    """
+    Store the Discord user and server IDs of the users table as 64-bit integers. SQLite integers are already
+    64-bit, so only databases on a server such as Postgres are changed.
+    """
+    if connection.dialect.name == "sqlite":
+        return
+    for column in ["discordId", "serverId"]:
+        connection.execute(text(f'ALTER TABLE users ALTER COLUMN "{column}" TYPE BIGINT'))
+
+migrations = [addLastUpdated, createRiotAccounts, addLeaderboardIndexes, seedRankHistory, addRefreshClaims,
+              addRegionsAndQueues, widenDiscordIds]
+
+def getVersion(connection):
+    """
+    Get the schema version stored in the database, 0 for databases created before versions were stored
+    """
+    connection.execute(text('CREATE TABLE IF NOT EXISTS "schemaVersion" (version INTEGER NOT NULL)'))
+    version = connection.execute(text('SELECT version FROM "schemaVersion"')).scalar()
+    if version is None:
+        connection.execute(text('INSERT INTO "schemaVersion" (version) VALUES (0)'))
+        return 0
+    return version
+
+def setVersion(connection, version):
+    """
+    Store the schema version in the database
+    """
+    connection.execute(text('UPDATE "schemaVersion" SET version = :version'), {"version": version})
+
+def upgrade(connection):
+    """
+    Create any missing tables and run the migrations the database has not had yet. New databases are
+    created with the latest schema, so they are marked as up to date without running any migrations.
+
+    Arguments:
+    connection - the synchronous connection to run the changes on
+    """
+    fresh = not inspect(connection).has_table("users")
+    users.Base.metadata.create_all(connection)
+    version = getVersion(connection)
+    if fresh:
+        setVersion(connection, len(migrations))
+        return
+    for migration in migrations[version:]:
+        migration(connection)
+    setVersion(connection, max(version, len(migrations)))
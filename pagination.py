@@ -14,13 +14,16 @@ class Pagination(discord.ui.View):
         self.getPage = getPage
         self.totalPages: Optional[int] = None
         self.index = 1
+
+        # Pages already shown on this message, so flipping back to a page shows it exactly as it was
+        self.pages = {}
         super().__init__(timeout = 60)
 
     async def navigate(self):
         """
         Send embed as message and add buttons if multiple pages
         """
-        emb, self.totalPages = await self.getPage(self.index)
+        emb, self.totalPages = await self.loadPage(self.index)
         if self.totalPages == 1:
             await self.interaction.followup.send(embed=emb)
         elif self.totalPages > 1:
@@ -34,10 +37,39 @@ class Pagination(discord.ui.View):
         Arguments:
         interaction - the command that the embed is a response to
         """
-        emb, self.totalPages = await self.getPage(self.index)
+        emb, self.totalPages = await self.loadPage(self.index)
         self.update_buttons()
         await interaction.response.edit_message(embed=emb, view=self)
 
+    async def refresh(self):
+        """
+        Rebuild the page being shown and edit the message in place, used when fresher data arrives after the
+        message was sent. The other pages are rebuilt when they are next shown.
+        """
+        self.pages.clear()
+        emb, self.totalPages = await self.loadPage(self.index)
+        if self.index > self.totalPages > 0:
+            self.index = self.totalPages
+            emb, self.totalPages = await self.loadPage(self.index)
+
+        # Add or remove the buttons if the number of pages changed, unless they already timed out
+        if self.totalPages > 1 and not self.is_finished():
+            self.update_buttons()
+            await self.interaction.edit_original_response(embed=emb, view=self)
+        else:
+            await self.interaction.edit_original_response(embed=emb, view=None)
+
+    async def loadPage(self, index: int):
+        """
+        Get a page of the message, only building it the first time it is shown
+
+        Arguments:
+        index - the number of the page to get
+        """
+        if index not in self.pages:
+            self.pages[index] = await self.getPage(index)
+        return self.pages[index]
+
     def update_buttons(self):
         """
         Disabled buttons if on first or last page
@@ -0,0 +1,210 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+
+# Request priorities, lower values are sent first when the rate limit budget is tight
+INTERACTIVE = 0 # a user is waiting on a single command (/info, /register)
+REFRESH = 1     # a command is waiting on a refresh of many players (/leaderboard, /ranks)
+BACKGROUND = 2  # nobody is waiting on the result
+
+class RateLimitWindow:
+    def __init__(self, limit: int, window: float):
+        """
+        Sliding window which allows at most limit requests in any window seconds
+
+        Arguments:
+        limit - the number of requests allowed in each window
+        window - the length of the window in seconds
+        """
+        self.limit = limit
+        self.window = window
+        self.sent = deque()
+
+    def prune(self, now: float):
+        """
+        Forget requests that are no longer inside the window
+        """
+        while len(self.sent) > 0 and self.sent[0] <= now - self.window:
+            self.sent.popleft()
+
+    def getDelay(self, now: float):
+        """
+        Get the number of seconds until another request can be sent (0 if one can be sent now)
+        """
+        self.prune(now)
+        if len(self.sent) < self.limit:
+            return 0
+        return self.sent[len(self.sent) - self.limit] + self.window - now
+
+    def record(self, now: float):
+        """
+        Record that a request was sent
+        """
+        self.sent.append(now)
+
+    def sync(self, count: int, now: float):
+        """
+        Match the window to the request count reported by Riot Games, which also counts requests
+        made by other processes sharing the same API key
+
+        Arguments:
+        count - the number of requests Riot Games has counted in the current window
+        now - the current time
+        """
+        self.prune(now)
+        while len(self.sent) < count:
+            self.sent.append(now)
+
+def parseLimits(header: str):
+    """
+    Parse a rate limit header such as "20:1,100:120" into a list of (limit, window) pairs
+
+    Arguments:
+    header - the value of an X-App-Rate-Limit or X-Method-Rate-Limit header
+    """
+    limits = []
+    for part in header.split(","):
+        limit, window = part.split(":")
+        limits.append((int(limit), int(window)))
+    return limits
+
+class RateLimiter:
+    def __init__(self, appLimits: str):
+        """
+        Scheduler which holds requests until they fit in the application and method rate limits.
+        When several requests are waiting the one with the lowest priority value is sent first.
+
+        Arguments:
+        appLimits - the application rate limits to use until Riot Games reports them, e.g. "20:1,100:120"
+        """
+        self.appWindows = [RateLimitWindow(limit, window) for limit, window in parseLimits(appLimits)]
+        self.methodWindows = {}
+        self.pausedUntil = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = asyncio.Condition()
+
+        # Counters exposed as metrics
+        self.sent = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def getWindows(self, method: str):
+        """
+        Get every window a request to this method has to fit in
+        """
+        return self.appWindows + self.methodWindows.get(method, [])
+
+    def getDelay(self, method: str, now: float):
+        """
+        Get the number of seconds until a request to this method can be sent
+        """
+        delay = max(0, self.pausedUntil - now)
+        for window in self.getWindows(method):
+            delay = max(delay, window.getDelay(now))
+        return delay
+
+    def isNext(self, entry, now: float):
+        """
+        Check whether the waiting entry is the highest priority request that can be sent right now
+        """
+        for other in sorted(self.waiting):
+            if self.getDelay(other[2], now) == 0:
+                return other is entry
+        return False
+
+    async def acquire(self, method: str, priority: int = INTERACTIVE):
+        """
+        Wait until a request to this method can be sent without going over the rate limits
+
+        Arguments:
+        method - name of the Riot Games API method being called
+        priority - the priority of the request (INTERACTIVE, REFRESH or BACKGROUND)
+        """
+        entry = [priority, next(self.counter), method]
+        throttled = False
+        async with self.condition:
+            self.waiting.append(entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self.isNext(entry, now):
+                        break
+                    if self.getDelay(method, now) > 0 and not throttled:
+                        self.throttled += 1
+                        throttled = True
+                    # Sleep until a window opens up or another request changes the state of the limiter
+                    timeout = max(self.getDelay(method, now), 0.01)
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting.remove(entry)
+                self.condition.notify_all()
+            for window in self.getWindows(method):
+                window.record(now)
+            self.sent += 1
+
+    def update(self, method: str, headers):
+        """
+        Update the limits and counts from the rate limit headers of a Riot Games API response
+
+        Arguments:
+        method - name of the Riot Games API method that was called
+        headers - the headers of the response
+        """
+        now = time.monotonic()
+        if "X-App-Rate-Limit" in headers:
+            self.appWindows = self.updateWindows(self.appWindows, headers["X-App-Rate-Limit"],
+                                                 headers.get("X-App-Rate-Limit-Count"), now)
+        if "X-Method-Rate-Limit" in headers:
+            self.methodWindows[method] = self.updateWindows(self.methodWindows.get(method, []),
+                                                            headers["X-Method-Rate-Limit"],
+                                                            headers.get("X-Method-Rate-Limit-Count"), now)
+
+    def updateWindows(self, windows, limitHeader: str, countHeader, now: float):
+        """
+        Build the windows described by a limit header, keeping the history of windows that did not change
+        """
+        existing = {(window.limit, window.window): window for window in windows}
+        updated = []
+        for limit, length in parseLimits(limitHeader):
+            updated.append(existing.get((limit, length), RateLimitWindow(limit, length)))
+        if countHeader is not None:
+            counts = {length: count for count, length in parseLimits(countHeader)}
+            for window in updated:
+                window.sync(counts.get(window.window, 0), now)
+        return updated
+
+    async def pause(self, seconds: float):
+        """
+        Stop sending requests for a number of seconds, used when Riot Games responds with 429
+
+        Arguments:
+        seconds - how long to wait before sending the next request
+        """
+        async with self.condition:
+            self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def getUsage(self):
+        """
+        Get the current usage of the rate limit budget
+
+        Returns:
+        usage - a dictionary with the requests used in every application and method window, the number of
+        requests waiting and the sent/throttled/retry counters
+        """
+        now = time.monotonic()
+        windows = []
+        for window in self.appWindows:
+            window.prune(now)
+            windows.append({"method": "application", "window": window.window, "limit": window.limit, "used": len(window.sent)})
+        for method, methodWindows in self.methodWindows.items():
+            for window in methodWindows:
+                window.prune(now)
+                windows.append({"method": method, "window": window.window, "limit": window.limit, "used": len(window.sent)})
+        return {"windows": windows, "waiting": len(self.waiting), "sent": self.sent,
+                "throttled": self.throttled, "retries": self.retries}
@@ -0,0 +1,98 @@
+from sqlalchemy import select
+import asyncio
+import logging
+import time
+import config
+import commands
+import coordinator
+import database
+import history
+import ratelimit
+import users
+
+logger = logging.getLogger(__name__)
+
+# Last time a command was used in each server, used to refresh active servers first
+activeServers = {}
+
+def markActive(server):
+    """
+    Record that a command was used in a server so its players are refreshed before others
+
+    Arguments:
+    server - the server ID of the server where the command was used
+    """
+    activeServers[server] = time.time()
+
+def getActiveServers():
+    """
+    Get the servers where a command was used within the last ACTIVE_SERVER_WINDOW seconds
+    """
+    cutoff = time.time() - config.ACTIVE_SERVER_WINDOW
+    for server in [server for server, lastActive in activeServers.items() if lastActive < cutoff]:
+        del activeServers[server]
+    return list(activeServers)
+
+async def getStaleAccounts(session, staleAfter = config.BACKGROUND_REFRESH_STALE_AFTER, batchSize = config.BACKGROUND_REFRESH_BATCH_SIZE):
+    """
+    Get the Riot Games accounts whose ranks should be refreshed next. Accounts registered in recently active
+    servers come first, then the rest, and within each group the accounts whose rank is the oldest come first.
+    Accounts no longer registered in any server and accounts another bot process is refreshing are left out.
+
+    Arguments:
+    session - the database session to load the accounts in
+    staleAfter - the number of seconds after which an account's rank is stale
+    batchSize - the maximum number of accounts to return
+
+    Returns:
+    accounts - the list of RiotAccount objects to refresh
+    """
+    now = time.time()
+    cutoff = now - staleAfter
+    stale = select(users.RiotAccount).where((users.RiotAccount.lastUpdated == None) | (users.RiotAccount.lastUpdated < cutoff),
+                                            users.RiotAccount.memberships.any(), coordinator.isClaimable(now))
+    oldestFirst = users.RiotAccount.lastUpdated.asc().nullsfirst()
+
+    inActive = users.RiotAccount.memberships.any(users.User.serverId.in_(getActiveServers()))
+    accounts = list((await session.scalars(stale.where(inActive).order_by(oldestFirst).limit(batchSize))).all())
+    if len(accounts) < batchSize:
+        accounts += (await session.scalars(stale.where(~inActive).order_by(oldestFirst).limit(batchSize - len(accounts)))).all()
+    return accounts
+
+async def refreshStale():
+    """
+    Refresh one batch of stale accounts in the background
+    """
+    async with database.Session() as session:
+        accounts = await getStaleAccounts(session)
+        if len(accounts) == 0:
+            return
+        failed = await commands.updateAccounts(session, accounts, priority = ratelimit.BACKGROUND,
+                                               deadline = config.BACKGROUND_REFRESH_INTERVAL)
+        logger.info("Background refresh updated %d accounts (%d failed)", len(accounts) - len(failed), len(failed))
+
+async def run(interval = config.BACKGROUND_REFRESH_INTERVAL, compact = True):
+    """
+    Keep refreshing stale players until cancelled so leaderboards can be shown straight from the database
+
+    Arguments:
+    interval - seconds to wait between refresh passes
+    compact - whether this process also downsamples old rank history, only needed in one process per database
+    """
+    lastCompacted = 0
+    while True:
+        try:
+            await refreshStale()
+        except Exception:
+            logger.exception("Background rank refresh failed")
+
+        # Downsample old rank history every HISTORY_COMPACT_INTERVAL seconds
+        if compact and time.time() - lastCompacted > config.HISTORY_COMPACT_INTERVAL:
+            try:
+                async with database.Session() as session:
+                    deleted = await history.compact(session)
+                logger.info("Removed %d old rank history entries", deleted)
+                lastCompacted = time.time()
+            except Exception:
+                logger.exception("Rank history compaction failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,330 @@
+import asyncio
+import time
+import aiohttp
+import constants
+import config
+import ratelimit
+import cache
+import circuit
+import metrics
+from typing import List, Optional, TypedDict
+from urllib.parse import quote
+
+# Base URLs for the platform (server specific) and regional (continent wide) Riot Games API hosts
+platforms = {platform: f"https://{platform}.api.riotgames.com" for platform in
+             ["na1", "br1", "la1", "la2", "euw1", "eun1", "tr1", "ru", "kr", "jp1", "oc1", "ph2", "sg2", "th2", "tw2", "vn2"]}
+regions = {region: f"https://{region}.api.riotgames.com" for region in ["americas", "europe", "asia"]}
+
+# Names of the platforms shown to users
+platformNames = {"na1": "North America", "br1": "Brazil", "la1": "Latin America North", "la2": "Latin America South",
+                 "euw1": "Europe West", "eun1": "Europe Nordic & East", "tr1": "Turkey", "ru": "Russia", "kr": "Korea",
+                 "jp1": "Japan", "oc1": "Oceania", "ph2": "Philippines", "sg2": "Singapore", "th2": "Thailand",
+                 "tw2": "Taiwan", "vn2": "Vietnam"}
+
+# Regional routing value used for account-v1 calls made on behalf of each platform
+regionForPlatform = {"na1": "americas", "br1": "americas", "la1": "americas", "la2": "americas", "oc1": "americas",
+                     "euw1": "europe", "eun1": "europe", "tr1": "europe", "ru": "europe",
+                     "kr": "asia", "jp1": "asia", "ph2": "asia", "sg2": "asia", "th2": "asia", "tw2": "asia", "vn2": "asia"}
+
+# Typed shapes of the Riot Games API responses used by the bot
+class Account(TypedDict):
+    puuid: str
+    gameName: str
+    tagLine: str
+
+class Summoner(TypedDict):
+    id: str
+    accountId: str
+    puuid: str
+    profileIconId: int
+    summonerLevel: int
+
+class LeagueEntry(TypedDict):
+    leagueId: str
+    summonerId: str
+    queueType: str
+    tier: str
+    rank: str
+    leaguePoints: int
+    wins: int
+    losses: int
+
+class LeagueItem(TypedDict):
+    summonerId: str
+    rank: str
+    leaguePoints: int
+    wins: int
+    losses: int
+
+class LeagueList(TypedDict):
+    leagueId: str
+    tier: str
+    queue: str
+    entries: List[LeagueItem]
+
+class ChampionMastery(TypedDict):
+    puuid: str
+    championId: int
+    championLevel: int
+    championPoints: int
+
+class RiotAPIError(Exception):
+    def __init__(self, status: int, url: str):
+        """
+        Error raised when the Riot Games API returns an unsuccessful response
+
+        Arguments:
+        status - the HTTP status code of the response
+        url - the URL that was requested
+        """
+        self.status = status
+        self.url = url
+        super().__init__(f"Riot Games API returned {status} for {url}")
+
+class CircuitOpenError(RiotAPIError):
+    def __init__(self, url: str):
+        """
+        Error raised without sending a request while the circuit breaker of its platform or region is open,
+        reported as a 503 like the errors that opened it
+
+        Arguments:
+        url - the URL that would have been requested
+        """
+        self.status = 503
+        self.url = url
+        Exception.__init__(self, f"Riot Games API is unavailable, not requesting {url}")
+
+class RiotClient:
+    def __init__(self, apiKey: str, connectionLimit: int = 50, maxRetries: int = config.RIOT_MAX_RETRIES):
+        """
+        Async client for the Riot Games API which shares one pooled, keep-alive HTTP session
+        between every command so requests never block the event loop. Every request goes through
+        the rate limiter of its routing value (Riot Games counts rate limits separately for each
+        platform and region) and is retried when Riot Games responds with 429 or a server error. While a
+        platform or region keeps failing its circuit breaker refuses requests instead of sending them.
+
+        Arguments:
+        apiKey - the Riot Games API key sent with every request
+        connectionLimit - the maximum number of open connections in the pool
+        maxRetries - the number of times a request is retried after a 429 or 5xx response
+        """
+        self.apiKey = apiKey
+        self.connectionLimit = connectionLimit
+        self.maxRetries = maxRetries
+        self.limiters = {}
+        self.breakers = {}
+        self.leagueCache = cache.TTLCache(config.LEAGUE_CACHE_TTL, config.LEAGUE_CACHE_SIZE)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def getSession(self):
+        """
+        Get the shared HTTP session, creating it on first use so it is bound to the running event loop
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit = self.connectionLimit, keepalive_timeout = 60)
+            self.session = aiohttp.ClientSession(connector = connector,
+                                                 headers = {"X-Riot-Token": self.apiKey},
+                                                 timeout = aiohttp.ClientTimeout(total = 10))
+        return self.session
+
+    def getLimiter(self, routing: str):
+        """
+        Get the rate limiter of a platform or region, creating it on first use
+
+        Arguments:
+        routing - the platform (e.g. na1) or region (e.g. americas) the request is sent to
+        """
+        if routing not in self.limiters:
+            self.limiters[routing] = ratelimit.RateLimiter(config.RIOT_APP_RATE_LIMITS)
+        return self.limiters[routing]
+
+    def getBreaker(self, routing: str):
+        """
+        Get the circuit breaker of a platform or region, creating it on first use
+
+        Arguments:
+        routing - the platform (e.g. na1) or region (e.g. americas) the request is sent to
+        """
+        if routing not in self.breakers:
+            self.breakers[routing] = circuit.CircuitBreaker()
+        return self.breakers[routing]
+
+    async def close(self):
+        """
+        Close the shared HTTP session and all pooled connections
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def get(self, routing: str, method: str, path: str, params: Optional[dict] = None,
+                  priority: int = ratelimit.INTERACTIVE):
+        """
+        Make a GET request to the Riot Games API once it fits in the rate limits and return the decoded JSON response
+
+        Arguments:
+        routing - the platform (e.g. na1) or region (e.g. americas) to send the request to
+        method - name of the Riot Games API method, used for its method rate limit
+        path - the path of the request on the platform or region host
+        params - optional query parameters for the request
+        priority - the priority of the request (ratelimit.INTERACTIVE, REFRESH or BACKGROUND)
+        """
+        url = f"{platforms[routing] if routing in platforms else regions[routing]}{path}"
+        limiter = self.getLimiter(routing)
+        breaker = self.getBreaker(routing)
+        for attempt in range(self.maxRetries + 1):
+            # Fail straight away during an outage rather than using up the rate limit budget and retries
+            if not breaker.allow():
+                raise CircuitOpenError(url)
+            waitStart = time.monotonic()
+            await limiter.acquire(method, priority)
+            metrics.observe("riot_rate_limit_wait_seconds", time.monotonic() - waitStart,
+                            {"routing": routing, "priority": priority})
+            try:
+                with metrics.span("riot_request", routing = routing, endpoint = method, attempt = attempt) as labels:
+                    response = await self.getSession().get(url, params = params)
+                    labels["status"] = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.recordFailure()
+                raise
+
+            # Server errors count towards opening the circuit, while any other response shows Riot Games is up.
+            # A 429 says nothing either way.
+            if response.status >= 500:
+                breaker.recordFailure()
+            elif response.status != 429:
+                breaker.recordSuccess()
+            async with response:
+                limiter.update(method, response.headers)
+                if response.status == 200:
+                    return await response.json()
+
+                # Give up on errors that will not go away by retrying, once out of retries, or once the errors
+                # opened the circuit
+                if ((response.status != 429 and response.status < 500) or attempt == self.maxRetries
+                        or breaker.getState() == circuit.OPEN):
+                    raise RiotAPIError(response.status, url)
+
+                # Wait as long as Riot Games asks after a 429, otherwise back off exponentially
+                limiter.retries += 1
+                metrics.increment("riot_retries_total", {"routing": routing, "endpoint": method, "status": response.status})
+                if response.status == 429 and "Retry-After" in response.headers:
+                    delay = float(response.headers["Retry-After"])
+                else:
+                    delay = 2 ** attempt
+                if response.status == 429 and response.headers.get("X-Rate-Limit-Type") != "service":
+                    await limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+    async def getAccountByRiotId(self, username: str, tag: str, platform: str = "na1",
+                                 priority: int = ratelimit.INTERACTIVE) -> Account:
+        """
+        Get the Riot account for a Riot ID (username and tag)
+
+        Arguments:
+        username - the username of the Riot Games account
+        tag - the unique identifier tag of the Riot Games account
+        platform - the platform the account plays on, used to pick the regional host
+        priority - the priority of the request
+        """
+        return await self.get(regionForPlatform[platform], "account-v1.by-riot-id",
+                              f"/riot/account/v1/accounts/by-riot-id/{quote(username)}/{quote(tag)}",
+                              priority = priority)
+
+    async def getSummonerByPuuID(self, puuID: str, platform: str = "na1", priority: int = ratelimit.INTERACTIVE) -> Summoner:
+        """
+        Get the League of Legends summoner for a puuID
+
+        Arguments:
+        puuID - the user's puuID
+        platform - the platform the summoner plays on
+        priority - the priority of the request
+        """
+        return await self.get(platform, "summoner-v4.by-puuid", f"/lol/summoner/v4/summoners/by-puuid/{puuID}",
+                              priority = priority)
+
+    async def getLeagueEntries(self, summonerID: str, platform: str = "na1",
+                               priority: int = ratelimit.INTERACTIVE, maxAge: float = None) -> List[LeagueEntry]:
+        """
+        Get the ranked league entries (one per queue) for a summoner. Entries are cached per summoner so
+        a player registered in several servers costs one request per cache TTL.
+
+        Arguments:
+        summonerID - the user's summoner ID
+        platform - the platform the summoner plays on
+        priority - the priority of the request
+        maxAge - optionally refetch if the cached entries are older than this many seconds (0 to always refetch)
+        """
+        async def fetch():
+            return await self.get(platform, "league-v4.entries-by-summoner",
+                                  f"/lol/league/v4/entries/by-summoner/{summonerID}", priority = priority)
+        return await self.leagueCache.getOrFetch((platform, summonerID), fetch, maxAge)
+
+    async def getLeagueEntriesPage(self, queue: str, tier: str, division: str, page: int = 1, platform: str = "na1",
+                                   priority: int = ratelimit.INTERACTIVE) -> List[LeagueEntry]:
+        """
+        Get one page of the ranked league entries of every player in a tier and division
+
+        Arguments:
+        queue - the ranked queue, e.g. RANKED_SOLO_5x5
+        tier - the tier, from IRON to DIAMOND
+        division - the division, from I to IV
+        page - the page number, starting at 1
+        platform - the platform to get the players of
+        priority - the priority of the request
+        """
+        return await self.get(platform, "league-v4.entries-by-division", f"/lol/league/v4/entries/{queue}/{tier}/{division}",
+                              params = {"page": page}, priority = priority)
+
+    async def getApexLeague(self, tier: str, queue: str, platform: str = "na1",
+                            priority: int = ratelimit.INTERACTIVE) -> LeagueList:
+        """
+        Get every player in an apex tier (MASTER, GRANDMASTER or CHALLENGER)
+
+        Arguments:
+        tier - the apex tier
+        queue - the ranked queue, e.g. RANKED_SOLO_5x5
+        platform - the platform to get the players of
+        priority - the priority of the request
+        """
+        return await self.get(platform, f"league-v4.{tier.lower()}leagues",
+                              f"/lol/league/v4/{tier.lower()}leagues/by-queue/{queue}", priority = priority)
+
+    async def getTopMasteries(self, puuID: str, count: int = 3, platform: str = "na1",
+                              priority: int = ratelimit.INTERACTIVE) -> List[ChampionMastery]:
+        """
+        Get the user's highest champion masteries
+
+        Arguments:
+        puuID - the user's puuID
+        count - the number of champions to return
+        platform - the platform the user plays on
+        priority - the priority of the request
+        """
+        return await self.get(platform, "champion-mastery-v4.top-by-puuid",
+                              f"/lol/champion-mastery/v4/champion-masteries/by-puuid/{puuID}/top",
+                              params = {"count": count}, priority = priority)
+
+# Shared client used by every module that talks to the Riot Games API
+client = RiotClient(constants.RIOT_KEY)
+
+def collectMetrics():
+    """
+    Get the rate limit budget and circuit breaker state of every platform and region and the league cache usage of the shared client as metric gauges
+    """
+    gauges = []
+    for routing, limiter in client.limiters.items():
+        usage = limiter.getUsage()
+        for window in usage["windows"]:
+            labels = {"routing": routing, "method": window["method"], "window": window["window"]}
+            gauges += [("riot_rate_limit_used", labels, window["used"]), ("riot_rate_limit_limit", labels, window["limit"])]
+        gauges += [("riot_requests_waiting", {"routing": routing}, usage["waiting"]),
+                   ("riot_requests_sent", {"routing": routing}, usage["sent"]),
+                   ("riot_requests_throttled", {"routing": routing}, usage["throttled"])]
+    for routing, breaker in client.breakers.items():
+        gauges += [("riot_circuit_open", {"routing": routing}, int(breaker.getState() != circuit.CLOSED)),
+                   ("riot_circuit_opened", {"routing": routing}, breaker.opened),
+                   ("riot_circuit_rejected", {"routing": routing}, breaker.rejected)]
+    gauges += [(f"league_cache_{stat}", None, value) for stat, value in client.leagueCache.getStats().items()]
+    return gauges
+
+metrics.addCollector(collectMetrics)
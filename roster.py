@@ -0,0 +1,319 @@
+from sqlalchemy import func, select
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import sys
+import time
+import commands
+import config
+import database
+import leaderboards
+import ratelimit
+import riot
+import users
+
+logger = logging.getLogger(__name__)
+
+# Columns of an import file. Region and queue are optional and default to North America and Solo/Duo.
+importFields = ["discordId", "username", "tag", "rank", "division", "lp", "region", "queue"]
+requiredFields = importFields[:6]
+
+# Columns written for each player by an export. The starting rank is written as rank, division and lp so an
+# exported file can be imported again as it is.
+exportColumns = [users.User.discordId, users.User.username, users.User.tag, users.User.platform.label("region"),
+                 users.User.queue, users.User.startRank.label("rank"), users.User.startDivision.label("division"),
+                 users.User.startLP.label("lp"), users.User.currRank, users.User.currDivision, users.User.currLP,
+                 users.User.valueChange, users.User.lastUpdated]
+historyColumns = [users.RankHistory.puuID, users.RankHistory.queue, users.RankHistory.timestamp, users.RankHistory.rank,
+                  users.RankHistory.division, users.RankHistory.lp, users.RankHistory.value]
+
+def parseRoster(data, filename):
+    """
+    Read the players listed in a CSV or JSON import file. CSV files have a header row naming the columns.
+    JSON files hold a list of player objects, or one object per line like the files written by exportServer
+    (where only the player lines are read).
+
+    Arguments:
+    data - the contents of the file
+    filename - the name of the file, used to tell CSV and JSON apart
+
+    Returns:
+    records - the list of players as dictionaries of column name to value
+    """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    if filename.lower().endswith(".csv"):
+        records = list(csv.DictReader(io.StringIO(data)))
+    elif filename.lower().endswith((".json", ".jsonl")):
+        try:
+            try:
+                records = json.loads(data)
+            except json.JSONDecodeError:
+                records = [json.loads(line) for line in data.splitlines() if line.strip() != ""]
+        except json.JSONDecodeError:
+            raise Exception("Import file is not valid JSON")
+        if isinstance(records, dict):
+            records = [records]
+        records = [record for record in records if record.get("type", "player") == "player"]
+    else:
+        raise Exception("Import files must be CSV or JSON")
+
+    if len(records) == 0:
+        raise Exception("Import file has no players")
+    for field in requiredFields:
+        if field not in records[0]:
+            raise Exception(f"Import file is missing the {field} column")
+    return records
+
+def readRecord(record):
+    """
+    Check one player from an import file and convert its values, raising an exception describing the first
+    problem found
+
+    Arguments:
+    record - dictionary of column name to value
+
+    Returns:
+    row - dictionary of the import columns with the values converted and defaults filled in
+    """
+    try:
+        row = {"discordId": int(record["discordId"]), "username": str(record["username"]).strip(),
+               "tag": str(record["tag"]).strip().lstrip("#"), "rank": str(record["rank"]).strip().upper(),
+               "division": str(record["division"]).strip().upper(), "lp": int(record["lp"])}
+    except (KeyError, TypeError, ValueError):
+        raise Exception("Discord ID and LP must be numbers")
+
+    # Regions and queues can be given by their ID or the name shown in /register
+    region = str(record.get("region") or "na1").strip().lower()
+    platforms = {**{platform: platform for platform in riot.platforms},
+                 **{name.lower(): platform for platform, name in riot.platformNames.items()}}
+    row["region"] = platforms.get(region, region)
+    queue = str(record.get("queue") or users.SOLO).strip()
+    queues = {**{key.lower(): key for key in users.queues}, **{name.lower(): key for key, name in users.queues.items()},
+              "solo": users.SOLO}
+    row["queue"] = queues.get(queue.lower(), queue)
+
+    commands.checkRegistration(row["tag"], row["rank"], row["division"], row["lp"], row["region"], row["queue"])
+    return row
+
+async def importPlayers(serverId, records, concurrency = config.RANK_REFRESH_CONCURRENCY, priority = ratelimit.REFRESH):
+    """
+    Register many players in a server at once. Riot IDs that are not stored yet are looked up concurrently
+    under the rate limiter, then every player that could be found is added in a single transaction. Players
+    that are already registered, have invalid information or cannot be found are skipped and reported.
+
+    Arguments:
+    serverId - the ID of the server to register the players in
+    records - the list of players read by parseRoster
+    concurrency - the maximum number of Riot Games API requests in flight at the same time
+    priority - the rate limiter priority of the requests
+
+    Returns:
+    imported - the number of players registered
+    failed - the list of (row number, Riot ID, reason) for the players that were skipped
+    """
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    # Check every row before calling Riot Games so mistakes in the file cost no requests
+    rows, seen = [], set()
+    for number, record in enumerate(records, 1):
+        try:
+            row = readRecord(record)
+            if row["discordId"] in seen:
+                raise Exception("Discord user is listed more than once")
+            seen.add(row["discordId"])
+            rows.append((number, row))
+        except Exception as e:
+            failed.append((number, f"{record.get('username')}#{record.get('tag')}", str(e)))
+
+    def getKey(row):
+        return row["username"].lower(), row["tag"].lower(), row["region"]
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    async def gatherByKey(coroutines):
+        # Run the lookups concurrently, keeping the results and the errors of each key apart
+        results = await asyncio.gather(*[limited(coroutine) for coroutine in coroutines.values()], return_exceptions = True)
+        return dict(zip(coroutines, results))
+
+    # Find the accounts already stored under the Riot IDs in one short read, so no session is held open
+    # while Riot Games is called
+    names = {row["username"].lower() for _, row in rows}
+    accounts = {}
+    async with database.Session() as session:
+        for account in (await session.scalars(select(users.RiotAccount)
+                                               .where(func.lower(users.RiotAccount.username).in_(names)))).all():
+            accounts[(account.username.lower(), account.tag.lower(), account.platform)] = account
+
+    # Look up the puuIDs of the other Riot IDs, then find which of them are stored under an older Riot ID
+    missing = {getKey(row): row for _, row in rows if getKey(row) not in accounts}
+    puuIDs = await gatherByKey({key: users.getPuuID(row["username"], row["tag"], row["region"], priority)
+                                for key, row in missing.items()})
+    errors = {key: puuID for key, puuID in puuIDs.items() if isinstance(puuID, Exception)}
+    found = {puuID: key for key, puuID in puuIDs.items() if key not in errors}
+    async with database.Session() as session:
+        for account in (await session.scalars(select(users.RiotAccount).where(users.RiotAccount.puuID.in_(found)))).all():
+            accounts[found.pop(account.puuID)] = account
+
+    # Create the accounts that are not stored, and get the current ranks of stored accounts that have no
+    # rank yet in a queue they are imported to track
+    created = await gatherByKey({key: users.createAccount(puuID, missing[key]["username"], missing[key]["tag"],
+                                                          missing[key]["region"], priority)
+                                 for puuID, key in found.items()})
+    for key, account in created.items():
+        if isinstance(account, Exception):
+            errors[key] = account
+        else:
+            accounts[key] = account
+
+    # Riot IDs written differently in the file can belong to the same account, and share its error if it
+    # could not be created
+    byPuuID = {account.puuID: account for account in accounts.values()}
+    for key, puuID in puuIDs.items():
+        if key not in accounts and key not in errors:
+            if puuID in byPuuID:
+                accounts[key] = byPuuID[puuID]
+            else:
+                errors[key] = errors[found[puuID]]
+
+    unranked = {}
+    for _, row in rows:
+        account = accounts.get(getKey(row))
+        if account is not None and account.getRank(row["queue"])[0] is None:
+            unranked[account.puuID] = account
+    createdIDs = {account.puuID for account in created.values() if not isinstance(account, Exception)}
+    currRanks = await gatherByKey({puuID: users.getCurrRanks(account.summonerID, account.platform, priority)
+                                   for puuID, account in unranked.items() if puuID not in createdIDs})
+
+    # Add every player that was found in one short transaction. The registered players and stored accounts are
+    # read again inside it, so players registered and accounts stored while Riot Games was called are skipped
+    # or reused instead of clashing with the rows added here.
+    players = []
+    async with database.Session() as session:
+        registered = set((await session.scalars(select(users.User.discordId).filter_by(serverId = serverId))).all())
+        stored = {account.puuID: account for account in (await session.scalars(
+            select(users.RiotAccount).where(users.RiotAccount.puuID.in_(byPuuID)))).all()}
+        for number, row in rows:
+            key, queue = getKey(row), row["queue"]
+            try:
+                if row["discordId"] in registered:
+                    raise Exception("User already registered in this server")
+                if key in errors:
+                    raise errors[key]
+                account = stored.get(accounts[key].puuID, accounts[key])
+                if account.platform != row["region"]:
+                    raise Exception(f"This Riot Games account is already registered on {riot.platformNames[account.platform]}")
+                if account.getRank(queue)[0] is None:
+                    ranks = currRanks.get(account.puuID, {})
+                    if isinstance(ranks, Exception):
+                        raise ranks
+                    if queue not in ranks:
+                        raise Exception(f"User is not ranked in {users.queues[queue]} queue.")
+                    account.updateRank(*ranks[queue], queue)
+                    session.add(users.RankHistory(account, queue))
+            except Exception as e:
+                failed.append((number, f"{row['username']}#{row['tag']}", str(e)))
+                continue
+
+            # New accounts are only stored once a player uses them
+            if account.puuID not in stored:
+                stored[account.puuID] = account
+                session.add(account)
+                for ranked in users.queues:
+                    if account.getRank(ranked)[0] is not None:
+                        session.add(users.RankHistory(account, ranked))
+            player = users.User(row["discordId"], serverId, account, row["rank"], row["division"], row["lp"], queue)
+            session.add(player)
+            players.append(player)
+        await session.commit()
+    leaderboards.updatePlayers(players)
+
+    failed.sort()
+    logger.info("Imported %d players into server %s in %.1fs, skipped %d", len(players), serverId,
+                time.monotonic() - start, len(failed))
+    return len(players), failed
+
+async def exportServer(serverId, output, batchSize = config.EXPORT_BATCH_SIZE):
+    """
+    Write a server's players and the rank history of their accounts as JSON lines: one {"type": "player"}
+    object per player followed by one {"type": "rankHistory"} object per rank change. Rows are streamed from
+    the database in batches, so a large server is never loaded into memory all at once.
+
+    Arguments:
+    serverId - the ID of the server to export
+    output - the binary file object to write to
+    batchSize - the number of rows read from the database at a time
+
+    Returns:
+    players, changes - the number of players and rank changes written
+    """
+    players, changes = 0, 0
+    async with database.Session() as session:
+        result = await session.stream(select(*exportColumns).where(users.User.serverId == serverId).order_by(users.User.discordId)
+                                      .execution_options(yield_per = batchSize))
+        async for row in result:
+            output.write((json.dumps({"type": "player", **row._asdict()}) + "\n").encode())
+            players += 1
+
+        accounts = select(users.User.puuID).filter_by(serverId = serverId)
+        result = await session.stream(select(*historyColumns).where(users.RankHistory.puuID.in_(accounts))
+                                      .order_by(users.RankHistory.puuID, users.RankHistory.timestamp)
+                                      .execution_options(yield_per = batchSize))
+        async for row in result:
+            output.write((json.dumps({"type": "rankHistory", **row._asdict()}) + "\n").encode())
+            changes += 1
+    return players, changes
+
+def formatFailures(failed, limit = 10):
+    """
+    Get the text listing the players skipped by an import
+
+    Arguments:
+    failed - the list of (row number, Riot ID, reason) returned by importPlayers
+    limit - the most players to list
+    """
+    lines = [f"Row {number} ({riotId}): {reason}" for number, riotId, reason in failed[:limit]]
+    if len(failed) > limit:
+        lines.append(f"...and {len(failed) - limit} more")
+    return "\n".join(lines)
+
+async def main(arguments):
+    """
+    Run an import or export from the command line
+    """
+    await database.init()
+    try:
+        if arguments.action == "import":
+            with open(arguments.file, "rb") as f:
+                records = parseRoster(f.read(), arguments.file)
+            imported, failed = await importPlayers(arguments.server, records)
+            print(f"Imported {imported} player(s), skipped {len(failed)}")
+            if len(failed) > 0:
+                print(formatFailures(failed, len(failed)))
+        elif arguments.output is None:
+            await exportServer(arguments.server, sys.stdout.buffer)
+        else:
+            with open(arguments.output, "wb") as f:
+                players, changes = await exportServer(arguments.server, f)
+            print(f"Exported {players} player(s) and {changes} rank change(s) to {arguments.output}")
+    finally:
+        await riot.client.close()
+        await database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Register players in a server from a file, or export a server's players and rank history")
+    subparsers = parser.add_subparsers(dest = "action", required = True)
+    importParser = subparsers.add_parser("import", help = "register the players listed in a CSV or JSON file")
+    importParser.add_argument("server", type = int, help = "ID of the discord server")
+    importParser.add_argument("file", help = "CSV or JSON file with discordId, username, tag, rank, division, lp and optionally region and queue")
+    exportParser = subparsers.add_parser("export", help = "write a server's players and rank history as JSON lines")
+    exportParser.add_argument("server", type = int, help = "ID of the discord server")
+    exportParser.add_argument("--output", "-o", help = "file to write to (default standard output)")
+    asyncio.run(main(parser.parse_args()))
@@ -1,7 +1,9 @@
-from sqlalchemy import ForeignKey, String, Integer, CHAR, Column, Boolean
+from sqlalchemy import ForeignKey, String, Integer, BigInteger, CHAR, Column, Boolean, Float, Index
 import sqlalchemy.orm
-import requests
-import constants
+from sqlalchemy.orm import relationship
+import time
+import riot
+import ratelimit
 
 Base = sqlalchemy.orm.declarative_base() # Base to be used for SQLAlchemy
 
@@ -9,99 +11,277 @@ Base = sqlalchemy.orm.declarative_base() # Base to be used for SQLAlchemy
 ranks = {"IRON": 0, "BRONZE": 400, "SILVER": 800, "GOLD": 1200, "PLATINUM": 1600, "EMERALD": 2000, "DIAMOND": 2400}
 divisions = {"I": 300, "II": 200, "III": 100, "IV": 0}
 
+# Ranked queues that can be tracked and their names shown to users
+SOLO = "RANKED_SOLO_5x5"
+FLEX = "RANKED_FLEX_SR"
+queues = {SOLO: "Solo/Duo", FLEX: "Flex"}
+
+# Class to be used to store a Riot Games account and its current rank. Each account is stored once and
+# shared by every server the account is registered in.
+class RiotAccount(Base):
+    __tablename__ = "riotAccounts"
+
+    # Riot Games identifying information
+    puuID = Column("puuID", String, primary_key = True)
+    username = Column("username", String)
+    tag = Column("tag", String)
+    summonerID = Column("summonerID", String)
+    accountID = Column("accountID", String)
+    profileIconId = Column("profileIconId", Integer)
+
+    # Platform the account plays on (a key of riot.platforms)
+    platform = Column("platform", String, nullable = False, default = "na1", server_default = "na1")
+
+    # Current Solo/Duo rank info
+    currRank = Column("currRank", String)
+    currDivision = Column("currDivision", String)
+    currLP = Column("currLP", Integer)
+    currValue = Column("currValue", Integer)
+
+    # Current Flex rank info, None if the account is not ranked in Flex
+    flexRank = Column("flexRank", String)
+    flexDivision = Column("flexDivision", String)
+    flexLP = Column("flexLP", Integer)
+    flexValue = Column("flexValue", Integer)
+
+    # Unix timestamp of the last time the current rank was fetched from Riot Games
+    lastUpdated = Column("lastUpdated", Float)
+
+    # Bot process currently refreshing the account and the Unix timestamp its claim expires, so processes
+    # running different shards do not fetch the same account at the same time (see coordinator.py)
+    refreshClaim = Column("refreshClaim", String)
+    refreshClaimedUntil = Column("refreshClaimedUntil", Float)
+
+    # Relationships are loaded together with their rows since async sessions cannot load them lazily
+    memberships = relationship("User", back_populates = "account", lazy = "selectin")
+
+    def __init__(self, puuID, username, tag, summonerID, accountID, profileIconId, currRank, currDivision, currLP,
+                 platform = "na1"):
+        self.puuID = puuID
+        self.username = username
+        self.tag = tag
+        self.summonerID = summonerID
+        self.accountID = accountID
+        self.profileIconId = profileIconId
+        self.platform = platform
+        self.updateRank(currRank, currDivision, currLP)
+
+    def getRank(self, queue = SOLO):
+        """
+        Get the account's current rank in a queue
+
+        Arguments:
+        queue - the ranked queue (SOLO or FLEX)
+
+        Returns:
+        rank, division, lp - the account's rank, or (None, None, None) if it is not ranked in the queue
+        """
+        if queue == FLEX:
+            return self.flexRank, self.flexDivision, self.flexLP
+        return self.currRank, self.currDivision, self.currLP
+
+    def updateRank(self, rank, division, lp, queue = SOLO):
+        """
+        Update the current rank of the account in a queue and of every server membership tracking that queue
+
+        Arguments:
+        rank - the account's current rank, or None if it is not ranked in the queue
+        division - the account's current division
+        lp - the account's current lp
+        queue - the ranked queue the rank is for (SOLO or FLEX)
+
+        Returns:
+        changed - whether the rank is different from the previous rank
+        """
+        self.lastUpdated = time.time()
+        if rank is None:
+            return False
+        changed = (rank, division, lp) != self.getRank(queue)
+        if queue == FLEX:
+            self.flexRank, self.flexDivision, self.flexLP = rank, division, lp
+            self.flexValue = getRankValue(rank, division, lp)
+        else:
+            self.currRank, self.currDivision, self.currLP = rank, division, lp
+            self.currValue = getRankValue(rank, division, lp)
+        for membership in self.memberships:
+            if membership.queue == queue:
+                membership.updateRank(rank, division, lp)
+        return changed
+
+# Class to be used to store a Riot Games account's rank each time it changes
+class RankHistory(Base):
+    __tablename__ = "rankHistory"
+
+    id = Column("id", Integer, primary_key = True, autoincrement = True)
+    puuID = Column("puuID", String, ForeignKey("riotAccounts.puuID"), nullable = False)
+    queue = Column("queue", String, nullable = False, default = SOLO, server_default = SOLO)
+
+    # Unix timestamp of when the rank was fetched and the rank at that time
+    timestamp = Column("timestamp", Float, nullable = False)
+    rank = Column("rank", String)
+    division = Column("division", String)
+    lp = Column("lp", Integer)
+    value = Column("value", Integer)
+
+    def __init__(self, account, queue = SOLO):
+        self.puuID = account.puuID
+        self.queue = queue
+        self.timestamp = account.lastUpdated
+        self.rank, self.division, self.lp = account.getRank(queue)
+        self.value = getRankValue(self.rank, self.division, self.lp)
+
 # Class to be used to store the user's information in the database using SQLAlchemy
 class User(Base):
     __tablename__ = "users"
 
     # Discord identifying information
-    discordId = Column("discordId", Integer, primary_key = True)
-    serverId = Column("serverId", Integer, primary_key = True)
+    # Discord IDs are 64-bit snowflakes, too large for a 32-bit INTEGER column on database servers
+    discordId = Column("discordId", BigInteger, primary_key = True)
+    serverId = Column("serverId", BigInteger, primary_key = True)
     
     # Riot Games identifying information
     username = Column("username", String)
     tag = Column("tag", String)
-    puuID = Column("puuID", String)
+    puuID = Column("puuID", String, ForeignKey("riotAccounts.puuID"))
     summonerID = Column("summonerID", String)
     accountID = Column("accountID", String)
 
+    # Platform the account plays on and the ranked queue tracked in this server
+    platform = Column("platform", String, nullable = False, default = "na1", server_default = "na1")
+    queue = Column("queue", String, nullable = False, default = SOLO, server_default = SOLO)
+
     # Start rank info
     startRank = Column("startRank", String)
     startDivision = Column("startDivision", String)
     startLP = Column("startLP", Integer)
     startValue = Column("startValue", Integer)
     
+    # Current rank info, copied from the Riot Games account so leaderboards only need this table
     currRank = Column("currRank", String)
     currDivision = Column("currDivision", String)
     currLP = Column("currLP", Integer)
     currValue = Column("currValue", Integer)
 
     valueChange = Column("valueChange", Integer)
+
+    # Unix timestamp of the last time the current rank was fetched from Riot Games
+    lastUpdated = Column("lastUpdated", Float)
+
+    account = relationship("RiotAccount", back_populates = "memberships", lazy = "selectin")
         
-    def __init__(self, discordId, serverId, username, tag, startRank, startDivision, startLP):
+    def __init__(self, discordId, serverId, account, startRank, startDivision, startLP, queue = SOLO):
         self.discordId = discordId
         self.serverId = serverId
         
-        self.username = username
-        self.tag = tag
-        self.puuID = getPuuID(username, tag)
-        self.summonerID = getSummonerID(self.puuID)
-        self.accountID = getAccountID(self.puuID)
+        self.account = account
+        self.username = account.username
+        self.tag = account.tag
+        self.puuID = account.puuID
+        self.summonerID = account.summonerID
+        self.accountID = account.accountID
+        self.platform = account.platform
+        self.queue = queue
 
         self.startRank = startRank
         self.startDivision = startDivision
         self.startLP = startLP
         self.startValue = getRankValue(startRank, startDivision, startLP)
 
-        self.currRank, self.currDivision, self.currLP = getCurrRank(self.summonerID)
-        self.currValue = getRankValue(self.currRank, self.currDivision, self.currLP)
+        self.updateRank(*account.getRank(queue))
 
+    def updateRank(self, rank, division, lp):
+        """
+        Update the user's current rank and their change in rank since registering
+
+        Arguments:
+        rank - the user's current rank
+        division - the user's current division
+        lp - the user's current lp
+        """
+        self.currRank, self.currDivision, self.currLP = rank, division, lp
+        self.currValue = getRankValue(rank, division, lp)
         self.valueChange = self.currValue - self.startValue
+        self.lastUpdated = time.time()
 
     def __repr__(self):
         if self.currValue > 0:
             return f"{self.username} {self.currRank} {self.currDivision} {self.currLP} (+{self.valueChange} lp)"
         else:
             return f"**{self.username}** {self.currRank} {self.currDivision} {self.currLP} (-{self.valueChange} lp)"
-        
-def getPuuID(username, tag):
+
+# Indexes for reading each server's leaderboards in order, loading an account's memberships and finding
+# the accounts that need refreshing. Existing databases get them from the migrations in migrations.py.
+Index("ix_users_serverId_valueChange", User.serverId, User.valueChange.desc())
+Index("ix_users_serverId_currValue", User.serverId, User.currValue.desc())
+Index("ix_users_puuID", User.puuID)
+Index("ix_riotAccounts_lastUpdated", RiotAccount.lastUpdated)
+Index("ix_rankHistory_puuID_timestamp", RankHistory.puuID, RankHistory.timestamp)
+
+async def createAccount(puuID, username, tag, platform = "na1", priority = ratelimit.INTERACTIVE):
     """
-    Get the Riot Games puuID for the user
+    Look up the summoner information and current ranks for a Riot Games account and create its RiotAccount object
 
     Arguments:
-    username - username to be used in API call
-    tag - unique identifier used in API call
+    puuID - the puuID of the Riot Games account
+    username - the username for the Riot Games account
+    tag - the unique identifier tag associated with the Riot Games account
+    platform - the platform the account plays on
+    priority - the rate limiter priority of the requests
     """
-    response = requests.get(f"https://americas.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{username}/{tag}?api_key={constants.RIOT_KEY}")
-    if response.status_code != 200:
-        raise Exception("Invalid Riot Games name and/or tag")
-    response = response.json()
-    return response["puuid"]
+    summoner = await getSummoner(puuID, platform, priority)
+    currRanks = await getCurrRanks(summoner["id"], platform, priority)
+    account = RiotAccount(puuID, username, tag, summoner["id"], summoner["accountId"], summoner["profileIconId"],
+                          *currRanks.get(SOLO, (None, None, None)), platform)
+    if FLEX in currRanks:
+        account.updateRank(*currRanks[FLEX], FLEX)
+    return account
+
+def getRiotError(error, message):
+    """
+    Get the exception to show the user for an unsuccessful Riot Games API response. Only a 404 means what was
+    requested does not exist. Outages, rate limiting and open circuit breakers are reported as Riot Games being
+    unavailable rather than as a problem with what the user entered.
+
+    Arguments:
+    error - the RiotAPIError raised by the request
+    message - the message to show when Riot Games could not find what was requested
+
+    Returns:
+    exception - the exception to raise
+    """
+    if error.status == 404:
+        return Exception(message)
+    return Exception("Riot Games is unavailable right now, please try again later")
 
-def getSummonerID(puuid):
+async def getPuuID(username, tag, platform = "na1", priority = ratelimit.INTERACTIVE):
     """
-    Gets the Riot Games summoner ID for the user
+    Get the Riot Games puuID for the user
 
     Arguments:
-    puuid - the user's puuid to be used in API call to get the summoner ID
+    username - username to be used in API call
+    tag - unique identifier used in API call
+    platform - the platform the account plays on, used to pick the regional host
+    priority - the rate limiter priority of the request
     """
-    response = requests.get(f"https://na1.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}?api_key={constants.RIOT_KEY}")
-    if response.status_code != 200:
-        raise Exception("Error getting account and summoner id from Riot Games")
-    response = response.json()
-    return response["id"]
+    try:
+        response = await riot.client.getAccountByRiotId(username, tag, platform, priority)
+    except riot.RiotAPIError as e:
+        raise getRiotError(e, "Invalid Riot Games name and/or tag")
+    return response["puuid"]
 
-def getAccountID(puuid):
+async def getSummoner(puuid, platform = "na1", priority = ratelimit.INTERACTIVE):
     """
-    Gets the Riot Games account ID for the user
+    Gets the Riot Games summoner (summoner ID, account ID and profile icon) for the user
 
     Arguments:
-    puuid - the user's puuid to be used in API call to get the account ID
+    puuid - the user's puuid to be used in API call to get the summoner
+    platform - the platform the account plays on
+    priority - the rate limiter priority of the request
     """
-    response = requests.get(f"https://na1.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}?api_key={constants.RIOT_KEY}")
-    if response.status_code != 200:
-        raise Exception("Error getting account and summoner id from Riot Games")
-    response = response.json()
-    return response["accountId"]
+    try:
+        return await riot.client.getSummonerByPuuID(puuid, platform, priority)
+    except riot.RiotAPIError as e:
+        raise getRiotError(e, "Error getting account and summoner id from Riot Games")
 
 def getRankValue(rank, division, lp):
     """
@@ -111,26 +291,34 @@ def getRankValue(rank, division, lp):
     rank - the user's rank
     division - the user's division
     lp - the user's lp
+
+    Returns:
+    value - the rank value, or None if the user is not ranked
     """
+    if rank is None:
+        return None
     if rank not in ["MASTER", "GRANDMASTER", "CHALLENGER"]:
         return ranks[rank] + divisions[division] + lp
     else:
         return lp + 2800
 
-def getCurrRank(summonerID):
+async def getCurrRanks(summonerID, platform = "na1", priority = ratelimit.INTERACTIVE):
     """
-    Gets the current rank for the user by calling Riot Games API
+    Gets the current ranks for the user by calling Riot Games API
 
     Arguments:
     summonerID - user's unique League of Legends ID to be used to get rank
+    platform - the platform the user plays on
+    priority - the rate limiter priority of the request
+
+    Returns:
+    ranks - a dictionary of queue to (rank, division, lp) for the tracked queues the user is ranked in
     """
-    response = requests.get(f"https://na1.api.riotgames.com/lol/league/v4/entries/by-summoner/{summonerID}?api_key={constants.RIOT_KEY}")
-    if response.status_code != 200:
-        raise Exception("Error getting current rank from Riot Games")
-    response = response.json()
-
-    # Finds the entry for Solo/Duo ranked to get the user's rank information in that mode
-    for entry in response:
-        if entry["queueType"] == "RANKED_SOLO_5x5":
-            return response[0]["tier"], response[0]["rank"], response[0]["leaguePoints"]
-    raise Exception("User is not ranked in Solo/Duo queue.")
\ No newline at end of file
+    try:
+        response = await riot.client.getLeagueEntries(summonerID, platform, priority)
+    except riot.RiotAPIError as e:
+        raise getRiotError(e, "Error getting current rank from Riot Games")
+
+    # Use the entry of each queue for the user's rank information in that queue
+    return {entry["queueType"]: (entry["tier"], entry["rank"], entry["leaguePoints"])
+            for entry in response if entry["queueType"] in queues}
\ No newline at end of file